@@ -0,0 +1,8 @@
+# (tab label, module implementing the tab). main.py imports a module when its tab is first opened,
+# and startup_benchmark.py measures the cold-start cost of each one.
+TABS = [
+    ("Generate Image", "generator"),
+    ("Product Editing(Subject Editing)", "product_editing"),
+    ("Editing with Mask", "edit"),
+    ("Editing with Gemini", "controlled_editing"),
+]
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuration variables
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", ".artifacts")
+ARTIFACT_SESSION_QUOTA = int(os.getenv("ARTIFACT_SESSION_QUOTA", str(256 * 1024 * 1024)))
+ARTIFACT_GLOBAL_QUOTA = int(os.getenv("ARTIFACT_GLOBAL_QUOTA", str(2 * 1024 * 1024 * 1024)))
+ARTIFACT_SESSION_TTL = float(os.getenv("ARTIFACT_SESSION_TTL", "3600"))  # seconds without a rerun
+ARTIFACT_GC_INTERVAL = float(os.getenv("ARTIFACT_GC_INTERVAL", "300"))
+
+_HEARTBEAT_FILE = ".last_seen"
+
+
+@dataclass
+class StoreStats:
+    sessions: int
+    files: int
+    bytes: int
+
+    def summary(self) -> str:
+        return f"{self.files} files in {self.sessions} sessions, {self.bytes / (1024 * 1024):.1f} MB"
+
+
+class ArtifactStore:
+    """
+    Output files named by content hash and scoped per session, so concurrent
+    sessions never overwrite each other. Per-session and global quotas are enforced
+    by evicting least-recently-used files, and a background thread removes the
+    directories of sessions that have gone away.
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR,
+                 session_quota: int = ARTIFACT_SESSION_QUOTA,
+                 global_quota: int = ARTIFACT_GLOBAL_QUOTA,
+                 session_ttl: float = ARTIFACT_SESSION_TTL,
+                 gc_interval: float = ARTIFACT_GC_INTERVAL):
+        self.root = root
+        self.session_quota = session_quota
+        self.global_quota = global_quota
+        self.session_ttl = session_ttl
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        if gc_interval > 0:
+            threading.Thread(target=self._gc_loop, args=(gc_interval,),
+                             name="artifact-gc", daemon=True).start()
+
+    def session_dir(self, session_id: str) -> str:
+        path = os.path.join(self.root, session_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def touch_session(self, session_id: str):
+        """Record that the session is alive; call on every rerun"""
+        heartbeat = os.path.join(self.session_dir(session_id), _HEARTBEAT_FILE)
+        with open(heartbeat, "a"):
+            pass
+        os.utime(heartbeat)
+
+    def put(self, session_id: str, data: bytes, extension: str = ".png") -> str:
+        """Store data under its SHA-256 and return the path. Identical content is written once."""
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.session_dir(session_id), f"{content_hash}{extension}")
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                return path
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._enforce_quotas_locked(session_id, keep=path)
+        return path
+
+    def remove(self, path: str):
+        with self._lock:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _list_files(self, directory: str) -> List[Tuple[float, int, str]]:
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name != _HEARTBEAT_FILE and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _evict(self, files: List[Tuple[float, int, str]], quota: int, keep: str):
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= quota:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def _enforce_quotas_locked(self, session_id: str, keep: str):
+        self._evict(self._list_files(self.session_dir(session_id)), self.session_quota, keep)
+        all_files = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                all_files.extend(self._list_files(entry.path))
+        self._evict(all_files, self.global_quota, keep)
+
+    def collect_orphans(self) -> int:
+        """Remove directories of sessions that have not rerun within session_ttl. Returns the number removed."""
+        removed = 0
+        cutoff = time.time() - self.session_ttl
+        with self._lock:
+            for entry in os.scandir(self.root):
+                if not entry.is_dir():
+                    continue
+                heartbeat = os.path.join(entry.path, _HEARTBEAT_FILE)
+                try:
+                    last_seen = os.path.getmtime(heartbeat)
+                except OSError:
+                    last_seen = entry.stat().st_mtime
+                if last_seen < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+        return removed
+
+    def _gc_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.collect_orphans()
+            except Exception as e:
+                print(f"Warning: artifact garbage collection failed: {e}")
+
+    def stats(self) -> StoreStats:
+        sessions = files = total = 0
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                sessions += 1
+                for _, size, _ in self._list_files(entry.path):
+                    files += 1
+                    total += size
+        return StoreStats(sessions, files, total)
+
+
+_default_store: Optional[ArtifactStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_store() -> ArtifactStore:
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = ArtifactStore()
+    return _default_store
+
+
+def current_session_id() -> str:
+    """Stable id for the current Streamlit session, marked alive on every call"""
+    import streamlit as st
+    if "artifact_session_id" not in st.session_state:
+        st.session_state.artifact_session_id = uuid.uuid4().hex
+    session_id = st.session_state.artifact_session_id
+    get_store().touch_session(session_id)
+    return session_id
+
+
+def save(data: bytes, extension: str = ".png") -> str:
+    """Store bytes for the current session and return the file path"""
+    return get_store().put(current_session_id(), data, extension)
@@ -0,0 +1,242 @@
+"""
+Headless batch generation: prompt reinterpretation with Gemini, Imagen generation and optional
+upscaling for every row of a CSV or JSONL manifest.
+
+Manifest columns (CSV header or JSON keys):
+    prompt        required
+    template      one of generator.PROMPT_TEMPLATE_OPTIONS (default "Keep Original")
+    aspect_ratio  one of generator.ASPECT_RATIO_OPTIONS (default "1:1")
+    instruction   custom reinterpretation instruction, used with template "User Input"
+    id            optional stable row id; derived from the other columns when missing
+
+    python batch_generate.py campaign.csv --output-dir out --concurrency 4 --upscale x2
+
+Images go to <output-dir>/images/<row id>/ and one JSON line per finished row is appended
+to <output-dir>/index.jsonl. Rows already recorded as "ok" are skipped on the next run,
+so an interrupted batch resumes where it stopped.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+INDEX_FILE = "index.jsonl"
+
+
+@dataclass
+class ManifestRow:
+    row_id: str
+    prompt: str
+    template: str = "Keep Original"
+    aspect_ratio: str = "1:1"
+    instruction: str = ""
+
+
+@dataclass
+class RowResult:
+    row_id: str
+    status: str  # "ok" or "failed"
+    prompt: str
+    template: str
+    aspect_ratio: str
+    positive_prompt: str = ""
+    negative_prompt: str = ""
+    files: List[Dict[str, str]] = field(default_factory=list)
+    latency: Dict[str, float] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+    finished_at: float = 0.0
+
+
+def _row_id(prompt: str, template: str, aspect_ratio: str, instruction: str) -> str:
+    key = json.dumps([prompt, template, aspect_ratio, instruction], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def load_manifest(path: str, template_options: List[str], aspect_ratio_options: List[str]) -> List[ManifestRow]:
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            records = list(csv.DictReader(f))
+
+    rows = []
+    for line_number, record in enumerate(records, start=1):
+        prompt = (record.get("prompt") or "").strip()
+        if not prompt:
+            raise ValueError(f"{path}: row {line_number} has no prompt")
+        template = (record.get("template") or "Keep Original").strip()
+        if template not in template_options:
+            raise ValueError(f"{path}: row {line_number} has unknown template {template!r}; "
+                             f"expected one of {template_options}")
+        aspect_ratio = (record.get("aspect_ratio") or "1:1").strip()
+        if aspect_ratio not in aspect_ratio_options:
+            raise ValueError(f"{path}: row {line_number} has unsupported aspect_ratio {aspect_ratio!r}; "
+                             f"expected one of {aspect_ratio_options}")
+        instruction = (record.get("instruction") or "").strip()
+        # The "User Input" template is only a placeholder for the instruction, and only it takes one
+        if template == "User Input" and not instruction:
+            raise ValueError(f"{path}: row {line_number} uses template 'User Input' but has no instruction")
+        if template != "User Input" and instruction:
+            raise ValueError(f"{path}: row {line_number} sets an instruction with template {template!r}; "
+                             f"instructions are only used with 'User Input'")
+        row_id = str(record.get("id") or "").strip() or _row_id(prompt, template, aspect_ratio, instruction)
+        rows.append(ManifestRow(row_id, prompt, template, aspect_ratio, instruction))
+
+    seen = set()
+    for row in rows:
+        if row.row_id in seen:
+            raise ValueError(f"{path}: duplicate row id {row.row_id}")
+        seen.add(row.row_id)
+    return rows
+
+
+def completed_row_ids(output_dir: str) -> set:
+    """Ids of rows recorded as finished; a partly written last line from an interrupted run is ignored"""
+    done = set()
+    try:
+        with open(os.path.join(output_dir, INDEX_FILE), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("status") == "ok":
+                    done.add(entry["row_id"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+class IndexWriter:
+    """Appends one JSON line per finished row and syncs it, so the index survives interruption"""
+
+    def __init__(self, output_dir: str):
+        self._path = os.path.join(output_dir, INDEX_FILE)
+        self._lock = threading.Lock()
+
+    def append(self, result: RowResult):
+        line = json.dumps(asdict(result), ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def run_row(row: ManifestRow, output_dir: str, upscale: Optional[str], upscale_model: str) -> RowResult:
+    import generator
+    from image_records import ImageRecord
+
+    result = RowResult(row.row_id, "failed", row.prompt, row.template, row.aspect_ratio)
+    if row.template == "User Input":
+        instruction = row.instruction
+    else:
+        instruction = generator.PROMPT_TEMPLATES[row.template]
+    try:
+        rewritten = generator.call_gemini(row.prompt, instruction)
+    except Exception as e:
+        result.errors.append(f"gemini: {e}")
+        result.finished_at = time.time()
+        return result
+    result.positive_prompt = rewritten["positive"]
+    result.negative_prompt = rewritten["negative"]
+
+    row_dir = os.path.join(output_dir, "images", row.row_id)
+    os.makedirs(row_dir, exist_ok=True)
+    for model_result in generator.iter_generated_images(
+            result.positive_prompt, result.negative_prompt, row.aspect_ratio):
+        label = model_result.label
+        prefix = label.lower().replace(" ", "")
+        result.latency[label] = round(model_result.seconds, 3)
+        if model_result.error is not None:
+            result.errors.append(f"{label}: {model_result.error}")
+            continue
+        for i, img in enumerate(model_result.response.images):
+            record = ImageRecord.from_vertex_image(img)
+            path = os.path.join(row_dir, f"{prefix}_image{i + 1}{record.extension}")
+            _write_atomic(path, record.data)
+            entry = {"model": label, "path": os.path.relpath(path, output_dir)}
+            if upscale:
+                try:
+                    upscaled = ImageRecord.from_vertex_image(generator.upscale_image(
+                        record, "upscale_factor", upscale_factor=upscale, model=upscale_model))
+                    upscaled_path = os.path.join(row_dir, f"upscaled_{prefix}_image{i + 1}{upscaled.extension}")
+                    _write_atomic(upscaled_path, upscaled.data)
+                    entry["upscaled_path"] = os.path.relpath(upscaled_path, output_dir)
+                except Exception as e:
+                    result.errors.append(f"upscale {label} {i + 1}: {e}")
+            result.files.append(entry)
+
+    # A row counts as done only when every model and upscale succeeded; otherwise it is retried on resume
+    result.status = "ok" if result.files and not result.errors else "failed"
+    result.finished_at = time.time()
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate images for every row of a prompt manifest")
+    parser.add_argument("manifest", help="CSV or JSONL file with prompt, template, aspect_ratio columns")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--concurrency", type=int, default=4, help="manifest rows processed at once")
+    parser.add_argument("--upscale", choices=["x2", "x4"], help="also upscale every generated image")
+    parser.add_argument("--upscale-model", choices=["imagen2", "imagen3"], default="imagen2")
+    parser.add_argument("--no-resume", action="store_true", help="run rows that already finished again")
+    args = parser.parse_args(argv)
+
+    # generator pulls in Streamlit and Vertex AI; import only after the arguments are valid
+    import generator
+    import rate_limiter
+
+    rows = load_manifest(args.manifest, generator.PROMPT_TEMPLATE_OPTIONS, generator.ASPECT_RATIO_OPTIONS)
+    os.makedirs(args.output_dir, exist_ok=True)
+    done = set() if args.no_resume else completed_row_ids(args.output_dir)
+    pending = [row for row in rows if row.row_id not in done]
+    print(f"{len(rows)} rows in manifest, {len(rows) - len(pending)} already done, {len(pending)} to run")
+
+    index = IndexWriter(args.output_dir)
+    failed = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="batch") as pool:
+        # The limiter is per process, so here it only paces this run's calls to the configured
+        # RPM; marking them bulk keeps the stats consistent with bulk work inside the app
+        with rate_limiter.context("batch", rate_limiter.BULK):
+            futures = {pool.submit(rate_limiter.capture_context().run, run_row,
+                                   row, args.output_dir, args.upscale, args.upscale_model): row
+                       for row in pending}
+        for finished, future in enumerate(as_completed(futures), start=1):
+            row = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = RowResult(row.row_id, "failed", row.prompt, row.template, row.aspect_ratio,
+                                   errors=[str(e)], finished_at=time.time())
+            index.append(result)
+            if result.status != "ok":
+                failed += 1
+            print(f"[{finished}/{len(pending)}] {row.row_id} {result.status}"
+                  + (f": {'; '.join(result.errors)}" if result.errors else ""))
+
+    print(f"Finished in {time.monotonic() - started:.1f}s: {len(pending) - failed} ok, {failed} failed. "
+          f"Index: {os.path.join(args.output_dir, INDEX_FILE)}")
+    print(f"Rate limits: {rate_limiter.summary()}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,12 @@
 import streamlit as st
-import os
-from vertexai.preview.vision_models import Image
 import sketchToImage
+from image_records import ImageRecord
+import response_cache
+import upload_ingest
+import image_normalizer
+import job_queue
+import single_flight
+import rate_limiter
 
 def initialize_session_state():
     """Session state 초기화 함수"""
@@ -18,6 +23,19 @@ def initialize_session_state():
             'edit_type': 'EDIT_MODE_DEFAULT',
         }
 
+# 스트리밍 중 완성되는 대로 표시할 Gemini 응답 필드
+STREAMED_FIELD_LABELS = {
+    'org_image_description': '원본 이미지 설명',
+    'main_object_description': '주요 객체',
+    'edit_type': 'Edit type',
+    'edit_mode': 'Edit mode',
+    'mask_mode': '마스크 모드',
+    'subject_type': '주요 오브젝트 타입',
+    'control_type': '컨트롤 타입',
+    'positive_prompt': '프롬프트',
+    'negative_prompt': '네거티브 프롬프트',
+}
+
 def main():
     # Session state 초기화
     initialize_session_state()
@@ -35,31 +53,48 @@ def main():
         )
 
         # 업로드된 이미지 경로 저장
+        # 업로드는 세션당 한 번만 저장되고, 이후 rerun에서는 같은 핸들을 재사용
+        controlled_edited_uploads = upload_ingest.ingest_uploads(
+            controlled_edited_uploaded_files, "controlled_edited_uploader"
+        )
         controlled_edited_image_paths = []
-        if controlled_edited_uploaded_files:
-            for uploaded_file in controlled_edited_uploaded_files:
-                # 임시 파일로 저장
-                temp_path = f"temp_{uploaded_file.name}"
-                with open(temp_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                controlled_edited_image_paths.append(temp_path)
-                
-                # 이미지 미리보기 표시
-                st.image(temp_path, caption=uploaded_file.name, use_column_width=True)
+        for upload in controlled_edited_uploads:
+            controlled_edited_image_paths.append(upload.path)
+            
+            # 이미지 미리보기 표시
+            st.image(upload.path, caption=upload.name, use_column_width=True)
         
         controlled_edited_editing_goal = st.text_area(
             "원하는 수정 사항을 적어주세요. ",
             key="controlled_edited_editing_goal"
         )
         
+        controlled_edited_fresh_sample = st.checkbox(
+            "Fresh Gemini sample",
+            value=False,
+            key="controlled_edited_fresh_sample"
+        )
+
         # 자동 파라미터 추출 버튼
         if st.button("자동 파라미터 추출", key="controlled_edited_extract_button"):
             if controlled_edited_image_paths:
                 try:
+                    # 응답을 스트리밍하면서 완성된 필드부터 바로 표시
+                    streamed_fields = st.container()
+                    placeholders = {}
+
+                    def show_field(path, value):
+                        if len(path) == 1 and path[0] in STREAMED_FIELD_LABELS:
+                            if path[0] not in placeholders:
+                                placeholders[path[0]] = streamed_fields.empty()
+                            placeholders[path[0]].markdown(f"**{STREAMED_FIELD_LABELS[path[0]]}**: {value}")
+
                     # 자동 파라미터 추출 함수 호출
                     result = sketchToImage.call_gemini_for_editing(
                         controlled_edited_image_paths[0],
-                        controlled_edited_editing_goal
+                        controlled_edited_editing_goal,
+                        fresh=controlled_edited_fresh_sample,
+                        on_field=show_field
                     )
 
                     print(result)
@@ -165,41 +200,58 @@ def main():
         st.write('value : {:.3f}'.format(controlled_edited_dilation))
         controlled_edited_guidance_scale = st.slider("Guidance Scale", min_value=0, max_value=600, value=1, step=1)
         st.write('value : {}'.format(controlled_edited_guidance_scale))
+        controlled_edited_bypass_cache = st.checkbox(
+            "Bypass response cache",
+            value=False,
+            key="controlled_edited_bypass_cache"
+        )
+        st.caption(f"Response cache: {response_cache.get_stats().summary()}")
+        st.caption(f"Upload size: {image_normalizer.get_stats().summary()}")
+        st.caption(f"Coalesced calls: {single_flight.summary()}")
+        st.caption(f"Rate limits: {rate_limiter.summary()}")
         # 이미지 수정 버튼
+        # 생성은 백그라운드 작업 큐에서 실행되므로 rerun이 일어나도 결과가 유지되고, 여러 작업을 동시에 실행 가능
         if st.button("이미지 수정", key="controlled_edited_modify_button"):
             if controlled_edited_image_paths:
-                try:
-                    if controlled_edited_edit_type == "SUBJECT_EDITING":
-                        controlled_edited_results = sketchToImage.subject_editing(
+                edit_type = controlled_edited_edit_type
+                use_cache = not controlled_edited_bypass_cache
+
+                def run_edit():
+                    if edit_type == "SUBJECT_EDITING":
+                        results = sketchToImage.subject_editing(
                             controlled_edited_prompt,
                             controlled_edited_negative_prompt,
                             controlled_edited_org_description,
                             controlled_edited_image_paths,
-                            controlled_edited_subject_type
+                            controlled_edited_subject_type,
+                            use_cache=use_cache
                         )
-                    elif controlled_edited_edit_type == "STYLE_EDITING":
-                        controlled_edited_results = sketchToImage.style_editing(
+                    elif edit_type == "STYLE_EDITING":
+                        results = sketchToImage.style_editing(
                             controlled_edited_prompt,
                             controlled_edited_negative_prompt,
                             controlled_edited_image_paths,
-                            controlled_edited_org_description
+                            controlled_edited_org_description,
+                            use_cache=use_cache
                         )
-                    elif controlled_edited_edit_type == "CONTROLLED_EDITING":
-                        controlled_edited_results = sketchToImage.controlled_editing(
+                    elif edit_type == "CONTROLLED_EDITING":
+                        results = sketchToImage.controlled_editing(
                             controlled_edited_prompt,
                             controlled_edited_negative_prompt,
                             controlled_edited_image_paths,
-                            controlled_edited_control_type
+                            controlled_edited_control_type,
+                            use_cache=use_cache
                         )
-                    elif controlled_edited_edit_type == "INSTRUCT_EDITING":
-                        controlled_edited_results = sketchToImage.instruct_editing(
+                    elif edit_type == "INSTRUCT_EDITING":
+                        results = sketchToImage.instruct_editing(
                             controlled_edited_prompt,
                             controlled_edited_negative_prompt,
                             controlled_edited_image_paths,
-                            seed
+                            seed,
+                            use_cache=use_cache
                         )
-                    elif controlled_edited_edit_type == "EDIT_MODE_DEFAULT":
-                        controlled_edited_results = sketchToImage.default_editing(
+                    elif edit_type == "EDIT_MODE_DEFAULT":
+                        results = sketchToImage.default_editing(
                             controlled_edited_prompt,
                             controlled_edited_negative_prompt,
                             controlled_edited_edit_mode,
@@ -207,28 +259,25 @@ def main():
                             controlled_edited_dilation,
                             controlled_edited_image_paths, 
                             seed, 
-                            controlled_edited_guidance_scale
+                            controlled_edited_guidance_scale,
+                            use_cache=use_cache
                         )
                     else:
-                        print("Wrong Editing Mode.")
-                    
-                    # 결과 이미지 저장 및 표시
-                    for idx, result_image in enumerate(controlled_edited_results):
-                        output_path = f"controlled_edited_result_{idx}.png"
-                        result_image.save(output_path)
-                        
-                        with controlled_edited_col2:
-                            st.image(output_path, caption=f"결과 이미지 {idx+1}")
-                            
-                except Exception as e:
-                    st.error(f"이미지 수정 중 오류가 발생했습니다: {str(e)}")
+                        raise ValueError(f"Wrong Editing Mode: {edit_type}")
+                    # 결과는 디스크에 저장하지 않고 메모리에 보관
+                    return [ImageRecord.from_vertex_image(result_image) for result_image in results]
+
+                job_queue.submit("controlled_editing", f"{edit_type}: {controlled_edited_prompt[:40]}", run_edit)
             else:
                 st.warning("이미지를 먼저 업로드해주세요.")
-        
-        # 임시 파일 정리
-        for path in controlled_edited_image_paths:
-            if os.path.exists(path):
-                os.remove(path)
+
+    # 작업 상태 표시 및 완료된 결과 이미지 표시
+    with controlled_edited_col2:
+        def show_results(job):
+            for idx, record in enumerate(job.result):
+                st.image(record.data, caption=f"결과 이미지 {idx+1}")
+
+        job_queue.render_jobs("controlled_editing", show_results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
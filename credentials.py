@@ -0,0 +1,243 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuration variables
+TOKEN_SOURCE = os.getenv("TOKEN_SOURCE", "gcloud")  # "gcloud" or "google-auth"
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "300"))  # seconds before expiry
+TOKEN_RETRY_INTERVAL = 30.0
+GCLOUD_TOKEN_LIFETIME = 3600.0
+# Assumed lifetime when gcloud's real expiry cannot be found: gcloud hands out its cached
+# token, which may be close to expiring, so stay short and let the refresher check again
+GCLOUD_UNKNOWN_EXPIRY_LIFETIME = 300.0
+TOKENINFO_URL = "https://oauth2.googleapis.com/tokeninfo"
+
+T = TypeVar("T")
+
+
+@dataclass
+class AccessToken:
+    token: str
+    expires_at: float  # epoch seconds
+
+
+TokenSource = Callable[[], AccessToken]
+
+
+def _parse_expiry(value: str) -> float:
+    expiry = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry.timestamp()
+
+
+def _tokeninfo_expiry(token: str) -> Optional[float]:
+    """Ask Google's tokeninfo endpoint how long token has left"""
+    try:
+        import requests
+        response = requests.get(TOKENINFO_URL, params={"access_token": token}, timeout=10)
+        response.raise_for_status()
+        return time.time() + float(response.json()["expires_in"])
+    except Exception as e:
+        print(f"Warning: could not look up access token expiry: {e}")
+        return None
+
+
+def gcloud_token_source() -> AccessToken:
+    """
+    Fetch a token from the gcloud CLI. gcloud returns its own cached token, which may be
+    close to expiring, so the real expiry is read from gcloud's JSON output or tokeninfo.
+    """
+    result = subprocess.run(
+        ["gcloud", "auth", "print-access-token", "--format=json"],
+        capture_output=True, text=True, check=True
+    )
+    output = result.stdout.strip()
+    try:
+        data = json.loads(output)
+    except ValueError:
+        # Older gcloud versions print the bare token
+        data = {"token": output}
+    if not isinstance(data, dict):
+        data = {"token": str(data)}
+    token = data["token"]
+    expires_at = None
+    expiry = data.get("token_expiry") or data.get("expiry")
+    if expiry:
+        try:
+            expires_at = _parse_expiry(expiry)
+        except ValueError:
+            pass
+    if expires_at is None:
+        expires_at = _tokeninfo_expiry(token)
+    if expires_at is None:
+        expires_at = time.time() + GCLOUD_UNKNOWN_EXPIRY_LIFETIME
+    return AccessToken(token, expires_at)
+
+
+class GoogleAuthTokenSource:
+    """Fetch tokens from Application Default Credentials via google-auth"""
+
+    SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+    def __init__(self):
+        import google.auth
+        import google.auth.transport.requests
+        self._credentials, _ = google.auth.default(scopes=self.SCOPES)
+        self._request = google.auth.transport.requests.Request()
+
+    def __call__(self) -> AccessToken:
+        self._credentials.refresh(self._request)
+        expiry = self._credentials.expiry
+        if expiry is None:
+            expires_at = time.time() + GCLOUD_TOKEN_LIFETIME
+        else:
+            # google-auth reports expiry as a naive UTC datetime
+            expires_at = expiry.replace(tzinfo=timezone.utc).timestamp()
+        return AccessToken(self._credentials.token, expires_at)
+
+
+class FakeTokenSource:
+    """Local token issuer for tests and offline runs"""
+
+    def __init__(self, lifetime: float = GCLOUD_TOKEN_LIFETIME, prefix: str = "fake-token"):
+        self.lifetime = lifetime
+        self.prefix = prefix
+        self.issued = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> AccessToken:
+        with self._lock:
+            self.issued += 1
+            return AccessToken(f"{self.prefix}-{self.issued}", time.time() + self.lifetime)
+
+
+class TokenProvider:
+    """
+    Caches an access token in memory and refreshes it in a background thread
+    before it expires. Safe to share between concurrent Streamlit sessions.
+    """
+
+    def __init__(self, source: TokenSource, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self._source = source
+        self._refresh_margin = refresh_margin
+        self._token: Optional[AccessToken] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def get_token(self) -> str:
+        token = self._token
+        if token is None or token.expires_at <= time.time():
+            with self._lock:
+                # Another thread may have refreshed while we were waiting
+                token = self._token
+                if token is None or token.expires_at <= time.time():
+                    token = self._refresh_locked()
+        self._ensure_refresher()
+        return token.token
+
+    def invalidate(self, token: Optional[str] = None):
+        """
+        Drop the cached token, e.g. after a 401 from the API. With token given, only drop
+        it if it is still the cached one (another thread may have refreshed already).
+        """
+        with self._lock:
+            if token is None or (self._token is not None and self._token.token == token):
+                self._token = None
+
+    def close(self):
+        self._stop.set()
+
+    def _refresh_locked(self) -> AccessToken:
+        self._token = self._source()
+        return self._token
+
+    def _ensure_refresher(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._lock:
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(
+                    target=self._refresh_loop, name="token-refresher", daemon=True
+                )
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            token = self._token
+            if token is None:
+                wait = 0.0
+            else:
+                remaining = token.expires_at - time.time()
+                # Refresh at the margin, or halfway through short-lived tokens
+                wait = max(remaining - self._refresh_margin, remaining / 2, 1.0)
+            if self._stop.wait(wait):
+                return
+            try:
+                with self._lock:
+                    self._refresh_locked()
+            except Exception as e:
+                print(f"Warning: access token refresh failed: {e}")
+                if self._stop.wait(TOKEN_RETRY_INTERVAL):
+                    return
+
+
+_default_provider: Optional[TokenProvider] = None
+_default_provider_lock = threading.Lock()
+
+
+def make_token_source(name: str = TOKEN_SOURCE) -> TokenSource:
+    if name == "google-auth":
+        return GoogleAuthTokenSource()
+    if name == "fake":
+        return FakeTokenSource()
+    return gcloud_token_source
+
+
+def get_token_provider() -> TokenProvider:
+    global _default_provider
+    if _default_provider is None:
+        with _default_provider_lock:
+            if _default_provider is None:
+                _default_provider = TokenProvider(make_token_source())
+    return _default_provider
+
+
+def set_token_provider(provider: TokenProvider):
+    """Replace the shared provider (tests can install one backed by FakeTokenSource)"""
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is not None:
+            _default_provider.close()
+        _default_provider = provider
+
+
+def get_access_token() -> str:
+    return get_token_provider().get_token()
+
+
+def _is_unauthorized(exc: BaseException) -> bool:
+    return getattr(getattr(exc, "response", None), "status_code", None) == 401
+
+
+def call_with_token(access_token: str, send: Callable[[str], T]) -> T:
+    """Call send(access_token); on a 401 drop the cached token and retry once with a fresh one"""
+    try:
+        return send(access_token)
+    except Exception as e:
+        if not _is_unauthorized(e):
+            raise
+        print("Access token rejected (401); refreshing and retrying once")
+        provider = get_token_provider()
+        provider.invalidate(access_token)
+        return send(provider.get_token())
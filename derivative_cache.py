@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuration variables
+DERIVATIVE_CACHE_MEMORY_BYTES = int(os.getenv("DERIVATIVE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+DERIVATIVE_CACHE_DIR = os.getenv("DERIVATIVE_CACHE_DIR", os.path.join(".cache", "derivatives"))
+DERIVATIVE_CACHE_DISK_BYTES = int(os.getenv("DERIVATIVE_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+
+
+@dataclass
+class DerivativeStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    def summary(self) -> str:
+        return f"{self.memory_hits} memory hits / {self.disk_hits} disk hits / {self.misses} renders"
+
+
+_hash_memo: Dict[str, Tuple[int, int, str]] = {}
+_hash_memo_lock = threading.Lock()
+
+
+def source_sha256(path: str) -> str:
+    """
+    SHA-256 of a file, memoized on (mtime, size).
+    A rewritten source gets a new stat, so it is rehashed and its old derivatives stop matching.
+    """
+    stat = os.stat(path)
+    with _hash_memo_lock:
+        memo = _hash_memo.get(path)
+    if memo is not None and memo[0] == stat.st_mtime_ns and memo[1] == stat.st_size:
+        return memo[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+    with _hash_memo_lock:
+        _hash_memo[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+    return content_hash
+
+
+def derivative_key(source_hash: str, transform: str, params: dict) -> str:
+    normalized = json.dumps({"source": source_hash, "transform": transform, "params": params}, sort_keys=True)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class DerivativeCache:
+    """
+    Two-level cache for rendered image variants.
+    A byte-bounded in-memory LRU spills evicted entries to disk, and the disk level is LRU-bounded too.
+    """
+
+    def __init__(self, memory_bytes: int = DERIVATIVE_CACHE_MEMORY_BYTES,
+                 directory: str = DERIVATIVE_CACHE_DIR, disk_bytes: int = DERIVATIVE_CACHE_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._stats = DerivativeStats()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats.memory_hits += 1
+                return data
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        with self._lock:
+            self._stats.disk_hits += 1
+        self._put_memory(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._stats.misses += 1
+        self._put_memory(key, data)
+
+    def _put_memory(self, key: str, data: bytes):
+        spilled = []
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= len(self._memory.pop(key))
+            self._memory[key] = data
+            self._memory_used += len(data)
+            while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+                old_key, old_data = self._memory.popitem(last=False)
+                self._memory_used -= len(old_data)
+                spilled.append((old_key, old_data))
+        for old_key, old_data in spilled:
+            self._spill(old_key, old_data)
+        if spilled:
+            self._evict_disk()
+
+    def _spill(self, key: str, data: bytes):
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".bin"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        while total > self.disk_bytes and entries:
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def stats(self) -> DerivativeStats:
+        with self._lock:
+            return DerivativeStats(self._stats.memory_hits, self._stats.disk_hits, self._stats.misses)
+
+
+_default_cache: Optional[DerivativeCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache() -> DerivativeCache:
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = DerivativeCache()
+    return _default_cache
+
+
+def get_derivative(source_path: str, transform: str, params: dict,
+                   render: Callable[[bytes], bytes]) -> bytes:
+    """Return render(source bytes), computing it only once per source content and params"""
+    cache = get_cache()
+    key = derivative_key(source_sha256(source_path), transform, params)
+    data = cache.get(key)
+    if data is None:
+        with open(source_path, "rb") as f:
+            data = render(f.read())
+        cache.put(key, data)
+    return data
+
+
+def get_derivative_for_bytes(source: bytes, source_hash: str, transform: str, params: dict,
+                             render: Callable[[bytes], bytes]) -> bytes:
+    """Same as get_derivative() for a source already held in memory"""
+    cache = get_cache()
+    key = derivative_key(source_hash, transform, params)
+    data = cache.get(key)
+    if data is None:
+        data = render(source)
+        cache.put(key, data)
+    return data
+
+
+def write_if_changed(path: str, data: bytes):
+    """Write data to path unless the file already holds exactly these bytes"""
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        if source_sha256(path) == hashlib.sha256(data).hexdigest():
+            return
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def get_stats() -> DerivativeStats:
+    return get_cache().stats()
@@ -1,14 +1,18 @@
 import streamlit as st
-import vertexai
-from vertexai.preview.vision_models import ImageGenerationModel, Image
 import typing
 from dotenv import load_dotenv
 import os
-from vertexai.preview.vision_models import ImageGenerationModel, Image
+import model_registry
+import resilience
+import job_queue
+from image_records import ImageRecord
 
 OUTPUT_URI = os.environ.get("OUTPUT_URI", "gs://")
 
 def main():
+    # Imported here so the SDK loads only when this tab renders
+    from vertexai.preview.vision_models import Image
+
     st.title("Image Editing App")
 
     # Create two columns
@@ -73,10 +77,6 @@ def main():
 
         if st.button("Edit Image"):
             if edit_uploaded_file is not None or edit_image_path:
-                # Initialize the model
-                #model = ImageGenerationModel.from_pretrained("imagegeneration@006")
-                model = ImageGenerationModel.from_pretrained(model_selection)
-                
                 params = {
                     "prompt": edit_prompt,
                     "base_image": edit_image if edit_uploaded_file else Image.load_from_file(edit_image_path),
@@ -103,18 +103,29 @@ def main():
                 # Remove None values
                 params = {k: v for k, v in params.items() if v is not None}
                 
-                # Generate the image
-                edit_result = model.edit_image(**params)
-                
-                # Display the result
-                with col2:
-                    st.header("Output")
-                    for i, edited_image in enumerate(edit_result.images):
-                        img_path = f'edited_image{i+1}.png'
-                        edited_image.save(img_path)
-                        st.image(img_path, caption=f"Edited Image {i+1}", use_column_width=True)
+                def run_edit():
+                    # Initialize the model
+                    #model = ImageGenerationModel.from_pretrained("imagegeneration@006")
+                    model = model_registry.get_image_model(model_selection)
+                    # Generate the image
+                    edit_result = resilience.call("edit_image", lambda: model.edit_image(**params),
+                                                  limit=f"model:{model_selection}")
+                    return [ImageRecord.from_vertex_image(edited_image) for edited_image in edit_result.images]
+
+                # Runs on the background job queue so reruns neither block on nor drop the edit
+                job_queue.submit("edit", f"{model_selection}: {edit_prompt[:40]}", run_edit)
             else:
                 st.error("Please upload an image or provide an image path")
 
+    # Display the results
+    with col2:
+        st.header("Output")
+
+        def show_results(job):
+            for i, record in enumerate(job.result):
+                st.image(record.data, caption=f"Edited Image {i+1}", use_column_width=True)
+
+        job_queue.render_jobs("edit", show_results)
+
 if __name__ == "__main__":
     edit_image_app()
\ No newline at end of file
@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuration variables
+ASSET_CACHE_BYTES = int(os.getenv("ASSET_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+_MAGIC_NUMBERS = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+def detect_mime_type(data: bytes, default: str = "image/png") -> str:
+    """MIME type from the file signature, regardless of the file name"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, mime_type in _MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mime_type
+    return default
+
+
+@dataclass
+class EncodedAsset:
+    """
+    An uploaded image read once and shared by every API call:
+    raw bytes for Gemini, base64 for Imagen, the MIME type and the content hash.
+    The base64 form is built on first use and kept, so retries, hedges and later
+    requests in the session stream it without encoding again.
+    """
+    data: bytes
+    mime_type: str
+    content_hash: str
+    path: str = ""
+    _base64: Optional[str] = field(default=None, repr=False)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, path: str = "") -> "EncodedAsset":
+        return cls(
+            data=data,
+            mime_type=detect_mime_type(data),
+            content_hash=hashlib.sha256(data).hexdigest(),
+            path=path,
+        )
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    def iter_base64(self, chunk_size: int) -> Iterator[bytes]:
+        # chunk_size counts raw bytes; the encoded slices are 4/3 of that
+        encoded = self.base64
+        step = max(chunk_size - chunk_size % 3, 3) * 4 // 3
+        for start in range(0, len(encoded), step):
+            yield encoded[start:start + step].encode("ascii")
+
+
+_assets = OrderedDict()  # (path, mtime_ns, size) -> EncodedAsset
+_assets_bytes = 0
+_assets_lock = threading.Lock()
+
+
+def _stat_key(path: str) -> Tuple[str, int, int]:
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _remember(key, asset: EncodedAsset):
+    global _assets_bytes
+    with _assets_lock:
+        if key in _assets:
+            return
+        _assets[key] = asset
+        # Budget for the base64 form too, since the first Imagen request builds it
+        _assets_bytes += len(asset.data) * 7 // 3
+        while _assets_bytes > ASSET_CACHE_BYTES and len(_assets) > 1:
+            _, evicted = _assets.popitem(last=False)
+            _assets_bytes -= len(evicted.data) * 7 // 3
+
+
+def register(path: str, data: bytes) -> EncodedAsset:
+    """Create the asset for a file whose bytes the caller already has (e.g. at upload time)"""
+    asset = EncodedAsset.from_bytes(data, path)
+    _remember(_stat_key(path), asset)
+    return asset
+
+
+def get_asset(path: str) -> EncodedAsset:
+    """Return the shared asset for path, reading the file only if its content is not cached yet"""
+    key = _stat_key(path)
+    with _assets_lock:
+        asset = _assets.get(key)
+        if asset is not None:
+            _assets.move_to_end(key)
+            return asset
+    with open(path, "rb") as f:
+        asset = EncodedAsset.from_bytes(f.read(), path)
+    _remember(key, asset)
+    return asset
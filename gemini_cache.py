@@ -0,0 +1,244 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Iterator, List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+import model_registry
+import resilience
+import runtime
+import single_flight
+from encoded_asset import EncodedAsset
+
+load_dotenv()
+
+# Configuration variables
+GEMINI_CACHE_TTL = float(os.getenv("GEMINI_CACHE_TTL", "3600"))  # seconds
+GEMINI_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "256"))
+
+# A content item is prompt text, an EncodedAsset, or an image given as (mime_type, data)
+Content = Union[str, EncodedAsset, Tuple[str, Union[bytes, str]]]
+
+
+@dataclass
+class MemoStats:
+    hits: int = 0
+    misses: int = 0
+    fresh: int = 0  # calls that skipped the cache on purpose
+
+    def summary(self) -> str:
+        return f"{self.hits} hits / {self.misses} misses / {self.fresh} fresh"
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl: float = GEMINI_CACHE_TTL, max_entries: int = GEMINI_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _content_digest(item: Content) -> Any:
+    if isinstance(item, str):
+        return item
+    if isinstance(item, EncodedAsset):
+        return {"mime_type": item.mime_type, "sha256": item.content_hash}
+    mime_type, data = item
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return {"mime_type": mime_type, "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def memo_key(model_name: str, contents: List[Content], generation_config: dict) -> str:
+    normalized = json.dumps(
+        {
+            "model": model_name,
+            "generation_config": generation_config,
+            "contents": [_content_digest(item) for item in contents],
+        },
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+_cache = TTLCache()
+_stats = MemoStats()
+_stats_lock = threading.Lock()
+
+
+def _to_generation_config(generation_config: dict):
+    # A response schema has to go through GenerationConfig, which converts it to the API's Schema type
+    if "response_schema" not in generation_config:
+        return generation_config
+    from vertexai.preview.generative_models import GenerationConfig
+    return GenerationConfig(**generation_config)
+
+
+def _to_part(item: Content):
+    if isinstance(item, str):
+        return item
+    if isinstance(item, EncodedAsset):
+        mime_type, data = item.mime_type, item.data
+    else:
+        mime_type, data = item
+    from vertexai.preview.generative_models import Part
+    return Part.from_data(mime_type=mime_type, data=data)
+
+
+def generate_text(model_name: str, contents: List[Content], generation_config: dict,
+                  fresh: bool = False) -> str:
+    """
+    Call Gemini and memoize the response text.
+    Pass fresh=True to draw a new sample; the new answer replaces the cached one.
+    """
+    key = memo_key(model_name, contents, generation_config)
+    if not fresh:
+        text = _cache.get(key)
+        if text is not None:
+            with _stats_lock:
+                _stats.hits += 1
+            return text
+    with _stats_lock:
+        if fresh:
+            _stats.fresh += 1
+        else:
+            _stats.misses += 1
+
+    def call():
+        model = model_registry.get_generative_model(model_name)
+        response = resilience.call(
+            f"gemini:{model_name}",
+            lambda: model.generate_content(
+                [_to_part(item) for item in contents],
+                generation_config=_to_generation_config(generation_config)
+            ),
+            limit=f"gemini:{model_name}"
+        )
+        text = response.text
+        _cache.put(key, text)
+        return text
+
+    # A fresh sample is requested on purpose, so it is never shared with another caller
+    if fresh:
+        return call()
+    return single_flight.do("gemini", key, call)
+
+
+def stream_text(model_name: str, contents: List[Content], generation_config: dict,
+                fresh: bool = False) -> Iterator[str]:
+    """
+    Like generate_text(), but yield the response text in pieces as Gemini produces it.
+    A cached response is yielded in one piece; a streamed one is cached once it is complete.
+    """
+    key = memo_key(model_name, contents, generation_config)
+    if not fresh:
+        text = _cache.get(key)
+        if text is not None:
+            with _stats_lock:
+                _stats.hits += 1
+            yield text
+            return
+    with _stats_lock:
+        if fresh:
+            _stats.fresh += 1
+        else:
+            _stats.misses += 1
+
+    # Same single-flight namespace as generate_text(): a caller that finds an identical
+    # request in flight waits for the whole text and gets it in one piece
+    flights = single_flight.get_group()
+    future, leader = (None, True) if fresh else flights.claim("gemini", key)
+    if not leader:
+        yield future.result()
+        return
+
+    def start_stream():
+        # Errors surface on the first chunk, so only getting that far is retried
+        model = model_registry.get_generative_model(model_name)
+        responses = iter(model.generate_content(
+            [_to_part(item) for item in contents],
+            generation_config=_to_generation_config(generation_config),
+            stream=True
+        ))
+        return next(responses, None), responses
+
+    pieces = []
+    try:
+        # A duplicate stream would double the output tokens, so streams are never hedged
+        first, responses = resilience.call(
+            f"gemini-stream:{model_name}", start_stream, replace(resilience.DEFAULT_POLICY, hedge=False),
+            limit=f"gemini:{model_name}")
+        for response in itertools.chain([first] if first is not None else [], responses):
+            piece = response.text
+            pieces.append(piece)
+            yield piece
+    except GeneratorExit:
+        # The consumer stopped early (e.g. a rerun); callers waiting on this flight still get the
+        # whole text, so the rest of the stream is read in the background
+        if future is not None:
+            runtime.get_executor().submit(_finish_stream, flights, key, future, pieces, responses)
+        raise
+    except BaseException as e:
+        if future is not None:
+            flights.finish("gemini", key, future, error=e)
+        raise
+    text = "".join(pieces)
+    _cache.put(key, text)
+    if future is not None:
+        flights.finish("gemini", key, future, text)
+
+
+def _finish_stream(flights: single_flight.SingleFlight, key: str, future, pieces: List[str], responses):
+    try:
+        for response in responses:
+            pieces.append(response.text)
+    except Exception as e:
+        flights.finish("gemini", key, future, error=e)
+        return
+    text = "".join(pieces)
+    _cache.put(key, text)
+    flights.finish("gemini", key, future, text)
+
+
+def forget(model_name: str, contents: List[Content], generation_config: dict):
+    """Drop a memoized response, e.g. one that could not be parsed"""
+    _cache.pop(memo_key(model_name, contents, generation_config))
+
+
+def get_stats() -> MemoStats:
+    with _stats_lock:
+        return MemoStats(_stats.hits, _stats.misses, _stats.fresh)
@@ -0,0 +1,100 @@
+import io
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+from encoded_asset import EncodedAsset
+
+load_dotenv()
+
+# Gemini bills an image as 258 tokens when both sides are <= 384px,
+# otherwise 258 tokens per 768x768 tile.
+TOKENS_PER_TILE = 258
+SMALL_IMAGE_SIZE = 384
+TILE_SIZE = 768
+
+# Configuration variables
+GEMINI_IMAGE_MAX_DIMENSION = int(os.getenv("GEMINI_IMAGE_MAX_DIMENSION", "768"))
+GEMINI_IMAGE_TOKEN_BUDGET = int(os.getenv("GEMINI_IMAGE_TOKEN_BUDGET", "0"))  # 0 = use the max dimension only
+GEMINI_IMAGE_JPEG_QUALITY = int(os.getenv("GEMINI_IMAGE_JPEG_QUALITY", "85"))
+GEMINI_IMAGE_CACHE_ENTRIES = 128
+
+if 0 < GEMINI_IMAGE_TOKEN_BUDGET < TOKENS_PER_TILE:
+    # No image costs less than one tile
+    print(f"Warning: GEMINI_IMAGE_TOKEN_BUDGET={GEMINI_IMAGE_TOKEN_BUDGET} is below one tile; "
+          f"using {TOKENS_PER_TILE}")
+    GEMINI_IMAGE_TOKEN_BUDGET = TOKENS_PER_TILE
+
+# Kept apart from the full-resolution assets and normalized references sent to Imagen
+_cache = OrderedDict()  # (content_hash, max_dimension, token_budget) -> EncodedAsset
+_lock = threading.Lock()
+
+
+def estimate_tokens(width: int, height: int) -> int:
+    if width <= SMALL_IMAGE_SIZE and height <= SMALL_IMAGE_SIZE:
+        return TOKENS_PER_TILE
+    return TOKENS_PER_TILE * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def target_size(width: int, height: int, max_dimension: int, token_budget: int) -> Tuple[int, int]:
+    """Largest size within max_dimension (and token_budget, if set) that keeps the aspect ratio"""
+    scale = min(1.0, max_dimension / max(width, height))
+    if token_budget > 0:
+        # A single-tile image is the cheapest there is, so smaller budgets stop there
+        token_budget = max(token_budget, TOKENS_PER_TILE)
+        while estimate_tokens(round(width * scale), round(height * scale)) > token_budget:
+            # Shrink to the next tile boundary on the long edge. Rounded, because
+            # max * (1536 / max) can come out as 1536.0000000000002 and stay at 3 tiles.
+            long_edge = round(max(width, height) * scale)
+            if long_edge <= SMALL_IMAGE_SIZE:
+                break
+            tiles = math.ceil(long_edge / TILE_SIZE)
+            next_edge = min((tiles - 1) * TILE_SIZE if tiles > 1 else SMALL_IMAGE_SIZE, long_edge - 1)
+            next_scale = next_edge / max(width, height)
+            if next_scale >= scale:
+                break
+            scale = next_scale
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_for_gemini(asset: EncodedAsset,
+                       max_dimension: int = GEMINI_IMAGE_MAX_DIMENSION,
+                       token_budget: Optional[int] = None) -> EncodedAsset:
+    """
+    Downsampled copy of an asset for Gemini analysis calls, with its real MIME type.
+    Analysis does not need multi-megapixel inputs, and latency and input tokens grow with them.
+    """
+    if token_budget is None:
+        token_budget = GEMINI_IMAGE_TOKEN_BUDGET
+    key = (asset.content_hash, max_dimension, token_budget)
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+
+    from PIL import Image as PILImage, ImageOps
+
+    with PILImage.open(io.BytesIO(asset.data)) as img:
+        img = ImageOps.exif_transpose(img)
+        size = target_size(img.width, img.height, max_dimension, token_budget)
+        if size == img.size:
+            prepared = asset
+        else:
+            img = img.resize(size, PILImage.LANCZOS, reducing_gap=2.0)
+            output = io.BytesIO()
+            if "A" in img.getbands() or "transparency" in img.info:
+                img.save(output, format="PNG", optimize=True)
+            else:
+                img.convert("RGB").save(output, format="JPEG", quality=GEMINI_IMAGE_JPEG_QUALITY)
+            prepared = EncodedAsset.from_bytes(output.getvalue(), asset.path)
+
+    with _lock:
+        _cache[key] = prepared
+        while len(_cache) > GEMINI_IMAGE_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return prepared
@@ -1,175 +1,76 @@
 import streamlit as st
-import json
-from vertexai.preview.generative_models import GenerativeModel, Part
-import vertexai
 from dotenv import load_dotenv
 import os
-from vertexai.preview.vision_models import ImageGenerationModel, Image
 import asyncio
+import hashlib
+import json
 import concurrent.futures
-from PIL import Image as PILImage
+import time
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+import runtime
+import resilience
+import single_flight
+import rate_limiter
+import structured_output
+import model_registry
+import derivative_cache
+from image_renderer import RenderSpec, render_derivatives
+from image_records import ImageRecord
+import artifact_store
 
 load_dotenv()
 
-PROJECT_ID = os.environ.get("PROJECT_ID")
-LOCATION = os.environ.get("LOCATION")
-
-vertexai.init(project=PROJECT_ID, location=LOCATION)
-
-imagen2_model = ImageGenerationModel.from_pretrained("imagegeneration@006")
-imagen3_model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-001")
-
-async def generate_images(model, positive_prompt, negative_prompt, aspect_ratio):
-    loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        response = await loop.run_in_executor(
-            pool,
-            lambda: model.generate_images(
-                prompt=positive_prompt,
-                negative_prompt=negative_prompt,
-                number_of_images=2,
-                aspect_ratio=aspect_ratio
-            )
-        )
+# Model handles are built lazily by model_registry on first use
+GENERATION_MODELS = [
+    ('Imagen 2', model_registry.IMAGEN2_MODEL),
+    ('Imagen 3', model_registry.IMAGEN3_MODEL),
+]
+
+UPSCALE_MODELS = {
+    'imagen2': model_registry.IMAGEN2_MODEL,
+    'imagen3': model_registry.IMAGEN3_MODEL,
+}
+
+async def generate_images(model_name, positive_prompt, negative_prompt, aspect_ratio):
+    loop = asyncio.get_running_loop()
+    # Process-wide pool shared by all sessions instead of a new pool per call.
+    # The model handle is resolved on the worker so a first-time load never blocks the loop.
+    # Throttling and overload errors are retried with backoff within the call deadline.
+    # Identical requests already in flight from other sessions share one upstream call.
+    request = {"model": model_name, "prompt": positive_prompt, "negative_prompt": negative_prompt,
+               "number_of_images": 2, "aspect_ratio": aspect_ratio}
+    key = hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    response = await loop.run_in_executor(
+        runtime.get_executor(),
+        lambda: single_flight.do("generate", key, lambda: resilience.call(
+            f"generate:{model_name}",
+            lambda: model_registry.get_image_model(model_name).generate_images(**{
+                name: value for name, value in request.items() if name != "model"
+            }),
+            limit=f"model:{model_name}"
+        ))
+    )
     print(response)
     return response
 
 def extract_json_value(json_str):
-    start_index = json_str.find('```json') + 7
-    end_index = json_str.find('```', start_index)
-    json_str = json_str[start_index:end_index].strip()
-    return json.loads(json_str)
-
-def resize_and_clip_image(image_path, output_path):
-    with PILImage.open(image_path) as img:
-        width, height = img.size
-        
-        target_ratio = 16 / 9
-        current_ratio = width / height
-        
-        if current_ratio > target_ratio:
-            new_width = int(height * target_ratio)
-            diff = width - new_width
-            left = diff // 2
-            right = width - (diff - left)
-            img = img.crop((left, 0, right, height))
-        else:
-            new_height = int(width / target_ratio)
-            diff = height - new_height
-            top = diff // 2
-            bottom = height - (diff - top)
-            img = img.crop((0, top, width, bottom))
-        
-        resolutions = [(3840, 2160), (1920, 1080), (960, 540)]
-        target_resolution = min(resolutions, key=lambda r: r[0] * r[1])
-        
-        img_resized = img.resize(target_resolution, PILImage.LANCZOS)
-        img_resized.save(output_path)
-    
-    return output_path
-
-
-def call_gemini(prompt, instruction):
-    prompt_template = f"""You are an advertising specialist using Imagen to create advertising images. 
-Analyze the given user prompt and transform it into a well-formed prompt suitable for Imagen. 
-The output should be in JSON format and must contain two keys: "positive" and "negative". All results must be generated in English.
-
-Based on the detailed instructions, generate the output.
-
-<User Prompt>
-{prompt}
-</User Prompt>
-
-<Detailed Instructions>
-{instruction}
-</Detailed Instructions>
-    """
-    model = GenerativeModel("gemini-1.5-flash")
-    response = model.generate_content(
-        [prompt_template],
-        generation_config={
-            "max_output_tokens": 2048,
-            "temperature": 0.8,
-            "top_p": 0.95,
-            "top_k": 32
-        }
-    )
-    return response.text
-
-async def generate_all_images(positive_prompt, negative_prompt, aspect_ratio):
-    tasks = [
-        generate_images(imagen2_model, positive_prompt, negative_prompt, aspect_ratio),
-        generate_images(imagen3_model, positive_prompt, negative_prompt, aspect_ratio)
-    ]
-    return await asyncio.gather(*tasks)
-
-def upscale_image(image_path, upscale_type, new_size=None, upscale_factor=None, model='imagen2', mime_type='image/png'):
-    with open(image_path, "rb") as f:
-        image_bytes = f.read()
-    print("*** start upscaling ***")    
-    image = Image(image_bytes=image_bytes)
-    
-    if model == 'imagen2':
-        model = imagen2_model
-    elif model == 'imagen3':
-        model = imagen3_model
-    
-    if upscale_type == 'new_size':
-        upscaled_image = model.upscale_image(
-            image=image,
-            new_size=int(new_size)
-        )
-    else:  # upscale_factor
-        upscaled_image = model.upscale_image(
-            image=image,
-            upscale_factor=upscale_factor
-        )
-    
-    print(upscaled_image)
-    return upscaled_image
-
-def get_image_resolution(image_path):
-    with PILImage.open(image_path) as img:
-        return img.size
-
-def update_file_path(img_path, mime_type):
-    # 기존 파일 이름과 디렉토리 분리
-    directory, filename = os.path.split(img_path)
-    filename_without_ext = os.path.splitext(filename)[0]
-    if mime_type == 'image/jpeg' :
-        new_extension = '.jpg'
-    else:
-        new_extension = '.png'
-    new_filename = f'upscaled_{filename_without_ext}{new_extension}'
-    upscaled_img_path = os.path.join(directory, new_filename)
-    
-    return upscaled_img_path
-
-def main():
-    # st.set_page_config(layout="wide")
-
-    if 'generated_images' not in st.session_state:
-        st.session_state.generated_images = []
-
-    left_column, right_column = st.columns([1, 2])
-
-    with left_column:
-        st.title("Prompt Analysis")
-
-        user_prompt = st.text_input("Enter the prompt for generating the image:")
-
-        display_options = [
-            "Keep Original",
-            "Descriptive Narration",
-            "Keyword Focus",
-            "Detailed Specifications",
-            "Copyright Considerations",
-            "User Input"
-        ]
-
-        # Detailed content to be used in the actual prompt
-        prompt_templates = {
-            "Keep Original": """
+    # Tolerates a missing or unclosed ```json fence and surrounding text
+    return structured_output.parse_json(json_str)
+
+# Prompt reinterpretation options, shared by the Generate tab and batch_generate.py
+PROMPT_TEMPLATE_OPTIONS = [
+    "Keep Original",
+    "Descriptive Narration",
+    "Keyword Focus",
+    "Detailed Specifications",
+    "Copyright Considerations",
+    "User Input"
+]
+
+# Detailed content to be used in the actual prompt
+PROMPT_TEMPLATES = {
+    "Keep Original": """
         When generating the image, please adhere to the following guidelines:
         1. Maintain the original sentence structure and expression as much as possible.
         2. Minimize unnecessary additional explanations or modifiers.
@@ -178,8 +79,8 @@ def main():
 
         Original Text: {text}
         """,
-            
-            "Descriptive Narration": """
+    
+    "Descriptive Narration": """
         Please reconstruct the original text in detail, following these guidelines:
         1. Specifically describe the overall atmosphere and emotion of the scene.
         2. Describe the appearance, texture, and condition of the elements in detail.
@@ -189,8 +90,8 @@ def main():
 
         Original Text: {text}
         """,
-            
-            "Keyword Focus": """
+    
+    "Keyword Focus": """
         Please reconstruct the prompt focusing on the following elements from the original text:
         1. Extract the core subjects/objects.
         2. Identify key actions and states.
@@ -202,8 +103,8 @@ def main():
 
         Original Text: {text}
         """,
-            
-             "Detailed Specifications": """
+    
+    "Detailed Specifications": """
         Please construct the prompt including the following technical specifications:
 
         [Style Specifications]
@@ -228,8 +129,8 @@ def main():
 
         Original Text: {text}
         """,
-            
-            "Copyright Considerations": """
+    
+    "Copyright Considerations": """
         Please generate a copyright-aware prompt according to the following guidelines:
 
         [Copyright Element Handling Guidelines]
@@ -258,9 +159,176 @@ def main():
 
         Original Text: {text}
         """,
-            
-            "User Input": "{text}"  # Use user-defined prompt as is
-        }
+    
+    "User Input": "{text}"  # Use user-defined prompt as is
+}
+
+ASPECT_RATIO_OPTIONS = [
+    "16:9",
+    "4:3",
+    "1:1"
+]
+
+RESIZE_ASPECT = (16, 9)
+RESIZE_RESOLUTIONS = [(3840, 2160), (1920, 1080), (960, 540)]
+RESIZE_SPEC = RenderSpec(RESIZE_ASPECT, min(RESIZE_RESOLUTIONS, key=lambda r: r[0] * r[1]))
+
+def _render_resized_and_clipped(image_bytes):
+    return render_derivatives(image_bytes, [RESIZE_SPEC])[RESIZE_SPEC]
+
+def resize_and_clip_image(image_path, output_path):
+    # Computed once per source content; later reruns reuse the cached PNG
+    resized = derivative_cache.get_derivative(
+        image_path,
+        "resize_and_clip",
+        {"aspect": RESIZE_SPEC.aspect, "size": RESIZE_SPEC.size, "format": RESIZE_SPEC.format},
+        _render_resized_and_clipped
+    )
+    derivative_cache.write_if_changed(output_path, resized)
+    return output_path
+
+def resize_and_clip_record(record: ImageRecord) -> ImageRecord:
+    """In-memory variant of resize_and_clip_image; nothing touches the disk"""
+    resized = derivative_cache.get_derivative_for_bytes(
+        record.data,
+        record.content_hash,
+        "resize_and_clip",
+        {"aspect": RESIZE_SPEC.aspect, "size": RESIZE_SPEC.size, "format": RESIZE_SPEC.format},
+        _render_resized_and_clipped
+    )
+    return ImageRecord(data=resized, width=RESIZE_SPEC.size[0], height=RESIZE_SPEC.size[1],
+                       format=RESIZE_SPEC.format)
+
+
+def call_gemini(prompt, instruction, fresh=False):
+    prompt_template = f"""You are an advertising specialist using Imagen to create advertising images. 
+Analyze the given user prompt and transform it into a well-formed prompt suitable for Imagen. 
+The output should be in JSON format and must contain two keys: "positive" and "negative". All results must be generated in English.
+
+Based on the detailed instructions, generate the output.
+
+<User Prompt>
+{prompt}
+</User Prompt>
+
+<Detailed Instructions>
+{instruction}
+</Detailed Instructions>
+    """
+    # Memoized on prompt and config; fresh=True asks Gemini for a new sample.
+    # Returns the parsed {"positive", "negative"} object.
+    return structured_output.generate_json(
+        "gemini-1.5-flash",
+        [prompt_template],
+        {
+            "max_output_tokens": 2048,
+            "temperature": 0.8,
+            "top_p": 0.95,
+            "top_k": 32
+        },
+        structured_output.PROMPT_REWRITE_SCHEMA,
+        fresh=fresh
+    )
+
+@dataclass
+class ModelResult:
+    label: str
+    response: Any = None
+    seconds: float = 0.0
+    error: Optional[Exception] = None
+
+
+async def _timed_generate(label, model_name, positive_prompt, negative_prompt, aspect_ratio):
+    started = time.monotonic()
+    try:
+        response = await generate_images(model_name, positive_prompt, negative_prompt, aspect_ratio)
+        return ModelResult(label, response, time.monotonic() - started)
+    except Exception as e:
+        return ModelResult(label, None, time.monotonic() - started, e)
+
+
+def iter_generated_images(positive_prompt, negative_prompt, aspect_ratio) -> Iterator[ModelResult]:
+    """
+    Start every model in GENERATION_MODELS at once and yield each result as soon as it finishes,
+    so the fastest model sets the time to first image. Failures are returned, not raised.
+    """
+    futures = [
+        runtime.submit(_timed_generate(label, model_name, positive_prompt, negative_prompt, aspect_ratio))
+        for label, model_name in GENERATION_MODELS
+    ]
+    for future in concurrent.futures.as_completed(futures):
+        yield future.result()
+
+def upscale_image(image_path, upscale_type, new_size=None, upscale_factor=None, model='imagen2', mime_type='image/png'):
+    # Accepts a file path or an in-memory ImageRecord
+    if isinstance(image_path, ImageRecord):
+        image_bytes = image_path.data
+    else:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+    print("*** start upscaling ***")    
+    from vertexai.preview.vision_models import Image
+    image = Image(image_bytes=image_bytes)
+    
+    model_name = model
+    model = model_registry.get_image_model(UPSCALE_MODELS[model_name])
+    
+    if upscale_type == 'new_size':
+        upscaled_image = resilience.call(f"upscale:{UPSCALE_MODELS[model_name]}", lambda: model.upscale_image(
+            image=image,
+            new_size=int(new_size),
+            output_mime_type=mime_type
+        ), limit=f"model:{UPSCALE_MODELS[model_name]}")
+    else:  # upscale_factor
+        upscaled_image = resilience.call(f"upscale:{UPSCALE_MODELS[model_name]}", lambda: model.upscale_image(
+            image=image,
+            upscale_factor=upscale_factor,
+            output_mime_type=mime_type
+        ), limit=f"model:{UPSCALE_MODELS[model_name]}")
+    
+    print(upscaled_image)
+    return upscaled_image
+
+def get_image_resolution(image_path):
+    from PIL import Image as PILImage
+    with PILImage.open(image_path) as img:
+        return img.size
+
+def update_file_path(img_path, mime_type):
+    # 기존 파일 이름과 디렉토리 분리
+    directory, filename = os.path.split(img_path)
+    filename_without_ext = os.path.splitext(filename)[0]
+    if mime_type == 'image/jpeg' :
+        new_extension = '.jpg'
+    else:
+        new_extension = '.png'
+    new_filename = f'upscaled_{filename_without_ext}{new_extension}'
+    upscaled_img_path = os.path.join(directory, new_filename)
+    
+    return upscaled_img_path
+
+def main():
+    # st.set_page_config(layout="wide")
+
+    if 'generated_images' not in st.session_state:
+        st.session_state.generated_images = []
+    if 'generation_latency' not in st.session_state:
+        st.session_state.generation_latency = {}
+
+    left_column, right_column = st.columns([1, 2])
+
+    with right_column:
+        st.title("Generated Images")
+        # Filled in per model while a generation is running
+        progress_area = st.container()
+
+    with left_column:
+        st.title("Prompt Analysis")
+
+        user_prompt = st.text_input("Enter the prompt for generating the image:")
+
+        display_options = PROMPT_TEMPLATE_OPTIONS
+        prompt_templates = PROMPT_TEMPLATES
 
         # Streamlit UI
         selected_display_option = st.selectbox("Prompt Reinterpretation Option", display_options)
@@ -272,11 +340,7 @@ def main():
         else:
             final_prompt_template = prompt_templates[selected_display_option]
 
-        aspect_ratio_options = [
-            "16:9",
-            "4:3",
-            "1:1"
-        ]
+        aspect_ratio_options = ASPECT_RATIO_OPTIONS
         selected_aspect_ratio = st.selectbox("Select Aspect Ratio", aspect_ratio_options)
 
         if final_prompt_template == "User Input":
@@ -284,37 +348,60 @@ def main():
         else:
             user_input = None
 
+        fresh_sample = st.checkbox("Fresh Gemini sample", value=False,
+                                   help="Ignore the cached analysis and ask Gemini again")
+
         if st.button("Analyze"):
             if user_prompt and final_prompt_template:
-                if final_prompt_template == "User Input":
-                    result = call_gemini(user_prompt, user_input)
-                else:
-                    result = call_gemini(user_prompt, final_prompt_template)
-
                 st.subheader("Analysis Result")
                 try:
-                    json_result = extract_json_value(result)
+                    if final_prompt_template == "User Input":
+                        json_result = call_gemini(user_prompt, user_input, fresh=fresh_sample)
+                    else:
+                        json_result = call_gemini(user_prompt, final_prompt_template, fresh=fresh_sample)
                     st.json(json_result)
 
-                    imagen2_response, imagen3_response = asyncio.run(generate_all_images(
-                        json_result['positive'], json_result['negative'], selected_aspect_ratio))
+                    # One placeholder per model, filled as soon as that model finishes
+                    slots = {}
+                    for label, _ in GENERATION_MODELS:
+                        slots[label] = progress_area.empty()
+                        slots[label].info(f"{label}: generating...")
 
+                    # Results stay in memory; files are written only when "Save results to disk" is set
                     st.session_state.generated_images = []
-                    for i, img in enumerate(imagen2_response.images):
-                        img_path = f'imagen2_image{i+1}.png'
-                        img.save(img_path)
-                        resolution = get_image_resolution(img_path)
-                        st.session_state.generated_images.append(('Imagen 2', img_path, resolution))
-
-                    for i, img in enumerate(imagen3_response.images):
-                        img_path = f'imagen3_image{i+1}.png'
-                        img.save(img_path)
-                        resolution = get_image_resolution(img_path)
-                        st.session_state.generated_images.append(('Imagen 3', img_path, resolution))
-
-                except json.JSONDecodeError:
-                    st.text(result)
+                    st.session_state.generation_latency = {}
+                    for result in iter_generated_images(
+                            json_result['positive'], json_result['negative'], selected_aspect_ratio):
+                        st.session_state.generation_latency[result.label] = result.seconds
+                        if result.error is not None:
+                            slots.pop(result.label).error(
+                                f"{result.label} failed after {result.seconds:.1f}s: {result.error}")
+                            continue
+                        prefix = result.label.lower().replace(' ', '')
+                        with slots[result.label].container():
+                            st.subheader(f"{result.label} ({result.seconds:.1f}s)")
+                            for i, img in enumerate(result.response.images):
+                                record = ImageRecord.from_vertex_image(img)
+                                st.session_state.generated_images.append((result.label, f'{prefix}_image{i+1}.png', record))
+                                st.image(record.data, use_column_width=True)
+
+                    # Clear the previews; the full results with upscale controls are rendered below
+                    for slot in slots.values():
+                        slot.empty()
+                    st.session_state.generated_images.sort(
+                        key=lambda item: [label for label, _ in GENERATION_MODELS].index(item[0]))
+
+                except ValueError as e:
+                    st.error(str(e))
         
+        st.caption(f"Shared workers: {runtime.get_stats().summary()}")
+        st.caption(f"Retries: {resilience.get_stats().summary()}")
+        st.caption(f"Coalesced calls: {single_flight.summary()}")
+        st.caption(f"Rate limits: {rate_limiter.summary()}")
+        load_times = model_registry.get_load_times()
+        if load_times:
+            st.caption("Model init: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in load_times.items()))
+
         st.subheader("Upscale Settings")
         upscale_type = st.selectbox("Upscale Method", ["new_size", "upscale_factor"])
         
@@ -325,35 +412,39 @@ def main():
 
         mime_type = st.selectbox("Mime Type", ["image/png", "image/jpeg"])
         upscale_model = st.selectbox("Upscale Model", ["imagen2", "imagen3"])
+        persist_outputs = st.checkbox("Save results to disk", value=False)
 
 
     with right_column:
-        st.title("Generated Images")
         if st.session_state.generated_images:
-            for i, (model_name, img_path, resolution) in enumerate(st.session_state.generated_images):
+            for i, (model_name, img_path, record) in enumerate(st.session_state.generated_images):
                 st.subheader(f"{model_name} Result {i%2 + 1}")
+                latency = st.session_state.generation_latency.get(model_name)
+                if latency is not None:
+                    st.caption(f"{model_name} latency: {latency:.1f}s")
                 
-                # Apply resize_and_clip_image function
-                resized_img_path = f'resized_{img_path}'
-                resized_img_path = resize_and_clip_image(img_path, resized_img_path)
+                # Resized variant is cached by content hash, so reruns skip the resize
+                resized_record = resize_and_clip_record(record)
+                if persist_outputs:
+                    # Session-scoped, content-addressed paths; concurrent sessions never collide
+                    st.caption(f"Saved to {artifact_store.save(record.data, record.extension)}")
+                    st.caption(f"Saved to {artifact_store.save(resized_record.data, resized_record.extension)}")
 
-                st.image(resized_img_path, use_column_width=True)
-                new_resolution = get_image_resolution(resized_img_path)
-                st.caption(f"Original Resolution: {resolution[0]}x{resolution[1]}")
-                st.caption(f"Adjusted Resolution: {new_resolution[0]}x{new_resolution[1]}")
+                st.image(resized_record.data, use_column_width=True)
+                st.caption(f"Original Resolution: {record.width}x{record.height}")
+                st.caption(f"Adjusted Resolution: {resized_record.width}x{resized_record.height}")
 
                 upscale_key = f"upscale_{model_name}_{i}"
                 if st.button(f"Upscale {model_name} Image {i%2 + 1}", key=upscale_key):
                     if upscale_type == "new_size":
-                        upscaled_img = upscale_image(resized_img_path, upscale_type, new_size=new_size, model=upscale_model, mime_type=mime_type)
+                        upscaled_img = upscale_image(resized_record, upscale_type, new_size=new_size, model=upscale_model, mime_type=mime_type)
                     else:
-                        upscaled_img = upscale_image(resized_img_path, upscale_type, upscale_factor=upscale_factor, model=upscale_model, mime_type=mime_type)
-                    new_img_path = update_file_path(resized_img_path, mime_type)
-                    upscaled_img_path = f'upscaled_{new_img_path}'
-                    upscaled_img.save(upscaled_img_path)
-                    upscaled_resolution = get_image_resolution(upscaled_img_path)
-                    st.image(upscaled_img_path, use_column_width=True)
-                    st.caption(f"Upscaled Resolution: {upscaled_resolution[0]}x{upscaled_resolution[1]}")
+                        upscaled_img = upscale_image(resized_record, upscale_type, upscale_factor=upscale_factor, model=upscale_model, mime_type=mime_type)
+                    upscaled_record = ImageRecord.from_vertex_image(upscaled_img)
+                    if persist_outputs:
+                        st.caption(f"Saved to {artifact_store.save(upscaled_record.data, upscaled_record.extension)}")
+                    st.image(upscaled_record.data, use_column_width=True)
+                    st.caption(f"Upscaled Resolution: {upscaled_record.width}x{upscaled_record.height}")
 
         else:
             st.text("Press the 'Analyze' button to generate images.")
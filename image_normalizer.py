@@ -0,0 +1,191 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from encoded_asset import EncodedAsset
+
+load_dotenv()
+
+# Configuration variables
+REFERENCE_NORMALIZE = os.getenv("REFERENCE_NORMALIZE", "true").lower() == "true"
+REFERENCE_MAX_DIMENSION = int(os.getenv("REFERENCE_MAX_DIMENSION", "1024"))  # long edge the model works at
+REFERENCE_JPEG_QUALITY = int(os.getenv("REFERENCE_JPEG_QUALITY", "95"))
+NORMALIZE_CACHE_ENTRIES = 128
+
+
+@dataclass
+class NormalizeStats:
+    requests: int = 0
+    images: int = 0
+    original_bytes: int = 0
+    normalized_bytes: int = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.normalized_bytes
+
+    def summary(self) -> str:
+        return (f"{self.images} reference images, "
+                f"{self.original_bytes / (1024 * 1024):.1f} MB -> {self.normalized_bytes / (1024 * 1024):.1f} MB")
+
+
+_cache = OrderedDict()  # (content_hash, max_dimension, quality) -> EncodedAsset
+_stats = NormalizeStats()
+_lock = threading.Lock()
+
+
+def _has_alpha(img) -> bool:
+    return "A" in img.getbands() or "transparency" in img.info
+
+
+def _encode_smallest(img) -> bytes:
+    """PNG for images with transparency; otherwise whichever of PNG and high-quality JPEG is smaller"""
+    png = io.BytesIO()
+    img.save(png, format="PNG", optimize=True)
+    if _has_alpha(img):
+        return png.getvalue()
+    jpeg = io.BytesIO()
+    img.convert("RGB").save(jpeg, format="JPEG", quality=REFERENCE_JPEG_QUALITY, optimize=True)
+    return min(png.getvalue(), jpeg.getvalue(), key=len)
+
+
+_JPEG_METADATA_MARKERS = {0xE1, 0xED, 0xFE}  # APP1 (EXIF, XMP), APP13 (IPTC), COM
+_PNG_METADATA_CHUNKS = {b"eXIf", b"tEXt", b"zTXt", b"iTXt", b"tIME"}
+
+
+def _strip_jpeg(data: bytes) -> bytes:
+    out = [data[:2]]
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            raise ValueError("bad JPEG segment")
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0xDA:  # start of scan: the rest is image data
+            out.append(data[i:])
+            return b"".join(out)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            out.append(data[i:i + 2])
+            i += 2
+            continue
+        end = i + 2 + int.from_bytes(data[i + 2:i + 4], "big")
+        if marker not in _JPEG_METADATA_MARKERS:
+            out.append(data[i:end])
+        i = end
+    raise ValueError("JPEG without image data")
+
+
+def _strip_png(data: bytes) -> bytes:
+    out = [data[:8]]
+    i = 8
+    while i + 8 <= len(data):
+        length = int.from_bytes(data[i:i + 4], "big")
+        chunk_type = data[i + 4:i + 8]
+        end = i + 12 + length
+        if chunk_type not in _PNG_METADATA_CHUNKS:
+            out.append(data[i:end])
+        i = end
+        if chunk_type == b"IEND":
+            return b"".join(out)
+    raise ValueError("PNG without IEND")
+
+
+def strip_metadata(asset: EncodedAsset) -> Optional[bytes]:
+    """
+    The asset's bytes without EXIF, XMP, IPTC and text metadata, removed losslessly.
+    None for formats this cannot rewrite (or files it cannot parse).
+    """
+    try:
+        if asset.mime_type == "image/jpeg":
+            return _strip_jpeg(asset.data)
+        if asset.mime_type == "image/png":
+            return _strip_png(asset.data)
+    except ValueError:
+        pass
+    return None
+
+
+def normalize_asset(asset: EncodedAsset, max_dimension: int = REFERENCE_MAX_DIMENSION) -> EncodedAsset:
+    """
+    Downscale to max_dimension on the long edge, apply and drop EXIF orientation and other
+    metadata, and re-encode compactly. Results are cached by content hash.
+    When the image is already small and upright, its original pixels are kept (with the
+    metadata stripped losslessly) if that is smaller than re-encoding.
+    """
+    key = (asset.content_hash, max_dimension, REFERENCE_JPEG_QUALITY)
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+
+    from PIL import Image as PILImage, ImageOps
+
+    with PILImage.open(io.BytesIO(asset.data)) as img:
+        needs_resize = max(img.size) > max_dimension
+        rotated = img.getexif().get(0x0112, 1) != 1  # EXIF Orientation
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA" if _has_alpha(img) else "RGB")
+        if needs_resize:
+            img.thumbnail((max_dimension, max_dimension), PILImage.LANCZOS, reducing_gap=2.0)
+        # Re-encoding from pixels drops EXIF, XMP and ICC blocks
+        data = _encode_smallest(img)
+
+    stripped = None if needs_resize or rotated else strip_metadata(asset)
+    if stripped is not None and len(stripped) <= len(data):
+        data = stripped
+    normalized = asset if data == asset.data else EncodedAsset.from_bytes(data, asset.path)
+
+    with _lock:
+        _cache[key] = normalized
+        while len(_cache) > NORMALIZE_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return normalized
+
+
+def _replace_assets(obj: Any, totals: list) -> Any:
+    if isinstance(obj, EncodedAsset):
+        normalized = normalize_asset(obj)
+        totals[0] += len(obj.data)
+        totals[1] += len(normalized.data)
+        totals[2] += 1
+        return normalized
+    if isinstance(obj, dict):
+        return {key: _replace_assets(value, totals) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_replace_assets(item, totals) for item in obj]
+    return obj
+
+
+def normalize_request(request_data: dict) -> Tuple[dict, int, int]:
+    """
+    Return a copy of request_data with every reference image normalized,
+    plus the original and normalized byte totals for the request.
+    """
+    if not REFERENCE_NORMALIZE:
+        return request_data, 0, 0
+    totals = [0, 0, 0]
+    normalized = _replace_assets(request_data, totals)
+    original_bytes, normalized_bytes, images = totals
+    if images:
+        with _lock:
+            _stats.requests += 1
+            _stats.images += images
+            _stats.original_bytes += original_bytes
+            _stats.normalized_bytes += normalized_bytes
+        print(f"Reference images normalized: {original_bytes} -> {normalized_bytes} bytes "
+              f"({original_bytes - normalized_bytes} saved)")
+    return normalized, original_bytes, normalized_bytes
+
+
+def get_stats() -> NormalizeStats:
+    with _lock:
+        return NormalizeStats(_stats.requests, _stats.images, _stats.original_bytes, _stats.normalized_bytes)
@@ -0,0 +1,57 @@
+import hashlib
+import io
+from dataclasses import dataclass, field
+from typing import Optional
+
+FORMAT_MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+
+@dataclass
+class ImageRecord:
+    """An image held in memory with its encoded bytes, size and format. Written to disk only on save()."""
+    data: bytes
+    width: int
+    height: int
+    format: str  # PIL format name, e.g. "PNG"
+    _content_hash: Optional[str] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ImageRecord":
+        from PIL import Image as PILImage
+        # Image.open only parses the header; pixels are not decoded here
+        with PILImage.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            image_format = img.format or "PNG"
+        return cls(data=data, width=width, height=height, format=image_format)
+
+    @classmethod
+    def from_vertex_image(cls, image) -> "ImageRecord":
+        return cls.from_bytes(image._image_bytes)
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def mime_type(self) -> str:
+        return FORMAT_MIME_TYPES.get(self.format, "application/octet-stream")
+
+    @property
+    def extension(self) -> str:
+        return ".jpg" if self.format == "JPEG" else f".{self.format.lower()}"
+
+    @property
+    def content_hash(self) -> str:
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.data).hexdigest()
+        return self._content_hash
+
+    def save(self, path: str) -> str:
+        with open(path, "wb") as f:
+            f.write(self.data)
+        return path
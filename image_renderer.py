@@ -0,0 +1,90 @@
+import io
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+# Configuration variables
+AD_ASPECT_RATIOS = [(16, 9), (1, 1), (9, 16), (4, 3)]
+AD_LONG_EDGES = [1920, 960]
+REDUCING_GAP = float(os.getenv("RENDER_REDUCING_GAP", "2.0"))  # box-reduce until within this factor of the target
+
+
+@dataclass(frozen=True)
+class RenderSpec:
+    aspect: Tuple[int, int]  # (width, height) ratio, e.g. (16, 9)
+    size: Tuple[int, int]  # output pixels
+    format: str = "PNG"
+    quality: int = 90  # JPEG/WEBP only
+
+    @property
+    def name(self) -> str:
+        return f"{self.aspect[0]}x{self.aspect[1]}_{self.size[0]}x{self.size[1]}.{self.format.lower()}"
+
+
+def size_for_long_edge(aspect: Tuple[int, int], long_edge: int) -> Tuple[int, int]:
+    ratio_w, ratio_h = aspect
+    if ratio_w >= ratio_h:
+        return long_edge, round(long_edge * ratio_h / ratio_w)
+    return round(long_edge * ratio_w / ratio_h), long_edge
+
+
+def ad_specs(aspects: Iterable[Tuple[int, int]] = AD_ASPECT_RATIOS,
+             long_edges: Iterable[int] = AD_LONG_EDGES,
+             format: str = "PNG") -> List[RenderSpec]:
+    """Every aspect ratio at every size used by the ad pipeline"""
+    return [RenderSpec(aspect, size_for_long_edge(aspect, edge), format)
+            for aspect in aspects for edge in long_edges]
+
+
+def center_crop_box(width: int, height: int, aspect: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    target_ratio = aspect[0] / aspect[1]
+    if width / height > target_ratio:
+        new_width = int(height * target_ratio)
+        left = (width - new_width) // 2
+        return left, 0, left + new_width, height
+    new_height = int(width / target_ratio)
+    top = (height - new_height) // 2
+    return 0, top, width, top + new_height
+
+
+def _encode(img, spec: RenderSpec) -> bytes:
+    output = io.BytesIO()
+    if spec.format.upper() in ("JPEG", "WEBP"):
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(output, format=spec.format, quality=spec.quality)
+    else:
+        img.save(output, format=spec.format)
+    return output.getvalue()
+
+
+def render_derivatives(image_bytes: bytes, specs: List[RenderSpec]) -> Dict[RenderSpec, bytes]:
+    """
+    Decode the source once and emit every requested crop and size.
+    JPEG sources are decoded at a reduced scale when every output is small enough,
+    and each resize box-reduces first so LANCZOS only runs on the last step.
+    """
+    from PIL import Image as PILImage
+
+    with PILImage.open(io.BytesIO(image_bytes)) as img:
+        full_width, full_height = img.size
+        if img.format == "JPEG":
+            # draft() picks the smallest DCT scale that is still >= the requested size.
+            # Ask for enough pixels that the tightest crop still covers its largest output.
+            needed_scale = max(
+                max(spec.size[0] / (box[2] - box[0]), spec.size[1] / (box[3] - box[1]))
+                for spec in specs
+                for box in [center_crop_box(full_width, full_height, spec.aspect)]
+            )
+            img.draft("RGB", (int(full_width * needed_scale) + 1, int(full_height * needed_scale) + 1))
+        img.load()
+        scale_x = img.size[0] / full_width
+        scale_y = img.size[1] / full_height
+
+        results = {}
+        for spec in specs:
+            left, top, right, bottom = center_crop_box(full_width, full_height, spec.aspect)
+            box = (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+            resized = img.resize(spec.size, PILImage.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
+            results[spec] = _encode(resized, spec)
+    return results
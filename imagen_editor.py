@@ -1,11 +1,17 @@
 from dotenv import load_dotenv
 import os
-import json
 import base64
-import requests
-from vertexai.preview.generative_models import GenerativeModel, Part
+import credentials
+import transport
+import resilience
+import response_cache
+import image_normalizer
+from streaming_body import iter_json
+from encoded_asset import get_asset
+from gemini_images import prepare_for_gemini
+import structured_output
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import Any, Callable, List, Dict, Optional
 from pprint import pprint
 
 load_dotenv()
@@ -25,7 +31,8 @@ class GeminiResponse:
 # Configuration variables
 REGION = "us-central1"
 CLOUD_PROJECT_ID = os.getenv("PROJECT_ID")
-ENDPOINT_URI_PREFIX = f"https://{REGION}-preprod-aiplatform.googleapis.com"
+# IMAGEN_ENDPOINT_PREFIX can point at standin_server.py to tune retry/hedging policies offline
+ENDPOINT_URI_PREFIX = os.getenv("IMAGEN_ENDPOINT_PREFIX", f"https://{REGION}-preprod-aiplatform.googleapis.com")
 ENDPOINT_URI = f"{ENDPOINT_URI_PREFIX}/v1/projects/{CLOUD_PROJECT_ID}/locations/{REGION}/publishers/google/models/imagen-3.0-capability-preview-0930:predict"
 
 def remove_reference_image(obj):
@@ -67,18 +74,17 @@ def print_request_data(request_data):
     pprint(remove_reference_image(request_data))
 
 def extract_json_value(json_str):
-    start_index = json_str.find('```json') + 7
-    end_index = json_str.find('```', start_index)
-    json_str = json_str[start_index:end_index].strip()
-    return json.loads(json_str)
-
-def call_gemini_for_editing(image_infos: List[ImageInfo], user_prompt: str) -> GeminiResponse:
-    images_parts = [
-        Part.from_data(
-            mime_type="image/png",
-            data=encode_image(img_info.path)
-        ) for img_info in image_infos
-    ]
+    # Tolerates a missing or unclosed ```json fence and surrounding text
+    return structured_output.parse_json(json_str)
+
+def call_gemini_for_editing(image_infos: List[ImageInfo], user_prompt: str, fresh: bool = False,
+                            on_field: Optional[Callable[[tuple, Any], None]] = None) -> GeminiResponse:
+    """
+    Analyze the product images and write the background prompts. With on_field, the response
+    is streamed and on_field(path, value) is called as each JSON field completes.
+    """
+    # Downsampled copies of the shared assets with their real MIME type; product_editing() sends the full assets
+    images_parts = [prepare_for_gemini(get_asset(img_info.path)) for img_info in image_infos]
     
     prompt_template = f"""
 당신은 Imagen을 이용하여 광고 이미지를 구성하는 광고 담당자입니다. 
@@ -115,19 +121,21 @@ def call_gemini_for_editing(image_infos: List[ImageInfo], user_prompt: str) -> G
 </output>
 """
 
-    model = GenerativeModel("gemini-1.5-flash")
-    response = model.generate_content(
+    generation_config = {
+        "max_output_tokens": 2048,
+        "temperature": 0.5,
+        "top_p": 0.93,
+        "top_k": 32
+    }
+    result = structured_output.generate_json(
+        "gemini-1.5-flash",
         [*images_parts, prompt_template],
-        generation_config={
-            "max_output_tokens": 2048,
-            "temperature": 0.5,
-            "top_p": 0.93,
-            "top_k": 32
-        }
+        generation_config,
+        structured_output.PRODUCT_ANALYSIS_SCHEMA,
+        fresh=fresh,
+        on_field=on_field
     )
     
-    result = extract_json_value(response.text)
-    
     # Update image infos with Gemini's analysis
     for i, img_analysis in enumerate(result["images"]):
         image_infos[i].subject_type = img_analysis["subject_type"]
@@ -140,21 +148,38 @@ def call_gemini_for_editing(image_infos: List[ImageInfo], user_prompt: str) -> G
     )
 
 def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+    return get_asset(image_path).base64
 
 def get_access_token():
-    stream = os.popen('gcloud auth print-access-token')
-    return stream.read().strip()
+    # Cached and refreshed in the background by the shared provider
+    return credentials.get_access_token()
 
-def make_prediction_request(endpoint_uri, access_token, request_data):
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    response = requests.post(endpoint_uri, headers=headers, json=request_data)
-    response.raise_for_status()
-    return response.json()
+def make_prediction_request(endpoint_uri, access_token, request_data, use_cache=True):
+    # Pooled keep-alive session shared by every tab; raises for bad status codes.
+    # The body is streamed in chunks; each reference image is base64-encoded once per asset.
+    # Reference images are downscaled and re-encoded before sending.
+    request_data, _, _ = image_normalizer.normalize_request(request_data)
+
+    def send(token):
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        # 429/503 are retried with backoff within a deadline; see resilience.py
+        # Every attempt takes a slot from the per-URL rate limiter; see rate_limiter.py
+        return resilience.call(
+            "imagen-predict",
+            lambda: transport.post_stream(endpoint_uri, headers, iter_json(request_data)),
+            limit=f"predict:{endpoint_uri}"
+        )
+
+    # Seeds are fixed, so identical requests are served from the disk cache.
+    return response_cache.cached_predict(
+        endpoint_uri, request_data,
+        # A rejected token is refreshed and the request sent once more
+        lambda: credentials.call_with_token(access_token, send),
+        use_cache=use_cache
+    )
 
 def convert_response_to_images(response):
     images = []
@@ -165,7 +190,7 @@ def convert_response_to_images(response):
                 images.append(image_bytes)
     return images
 
-def product_editing(gemini_response: GeminiResponse):
+def product_editing(gemini_response: GeminiResponse, use_cache: bool = True):
     """
     Create a background image for multiple products using Imagen
     """
@@ -178,7 +203,7 @@ def product_editing(gemini_response: GeminiResponse):
             "referenceType": "REFERENCE_TYPE_SUBJECT",
             "referenceId": 1,
             "referenceImage": {
-                "bytesBase64Encoded": encode_image(img_info.path)
+                "bytesBase64Encoded": get_asset(img_info.path)
             },
             "subjectImageConfig": {
                 "subjectDescription": img_info.subject_description,
@@ -206,7 +231,7 @@ def product_editing(gemini_response: GeminiResponse):
 
     print_request_data(request_data)
 
-    response = make_prediction_request(ENDPOINT_URI, access_token, request_data)
+    response = make_prediction_request(ENDPOINT_URI, access_token, request_data, use_cache=use_cache)
 
     return convert_response_to_images(response)
 
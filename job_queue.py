@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+import rate_limiter
+import runtime
+
+load_dotenv()
+
+# Configuration variables
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # long Imagen calls running at once, across all sessions
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))  # seconds a finished job's result is kept
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+@dataclass
+class Job:
+    job_id: str
+    session_id: str
+    label: str
+    status: str = QUEUED
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[Exception] = None
+    _future: Any = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds running so far, or the total run time once finished"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobQueue:
+    """
+    Process-wide queue for long Imagen calls. Jobs run on their own worker pool, which
+    outlives Streamlit reruns, so a widget change never abandons a running edit.
+    Results stay in memory for JOB_RETENTION seconds after the job finishes.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, retention: float = JOB_RETENTION):
+        # Separate from runtime's shared pool: jobs block on calls that run there
+        self._executor = runtime.SharedExecutor(workers, thread_name_prefix="imagen-job")
+        self._retention = retention
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id: str, label: str, fn: Callable, *args,
+               priority: int = rate_limiter.INTERACTIVE, **kwargs) -> str:
+        """Queue fn; its Vertex AI calls are rate limited as session_id at the given priority"""
+        self.prune()
+        job = Job(job_id=uuid.uuid4().hex[:12], session_id=session_id, label=label)
+
+        def run():
+            if job.status == CANCELLED:
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                with rate_limiter.context(session_id, priority):
+                    job.result = fn(*args, **kwargs)
+                job.status = DONE
+            except Exception as e:
+                job.error = e
+                job.status = FAILED
+            finally:
+                job.finished_at = time.time()
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+        job._future = self._executor.submit(run)
+        return job.job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, session_id: str) -> List[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.session_id == session_id]
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not started yet. Running jobs cannot be interrupted."""
+        job = self.get(job_id)
+        if job is None or job.status != QUEUED or not job._future.cancel():
+            return False
+        job.status = CANCELLED
+        job.finished_at = time.time()
+        return True
+
+    def forget(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def prune(self) -> int:
+        """Drop finished jobs older than the retention period. Returns the number removed."""
+        cutoff = time.time() - self._retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def stats(self) -> runtime.RuntimeStats:
+        return self._executor.stats()
+
+
+_default_queue: Optional[JobQueue] = None
+_default_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    global _default_queue
+    if _default_queue is None:
+        with _default_queue_lock:
+            if _default_queue is None:
+                _default_queue = JobQueue()
+    return _default_queue
+
+
+def _session_key(key: str) -> str:
+    return f"_jobs_{key}"
+
+
+def submit(key: str, label: str, fn: Callable, *args, priority: Optional[int] = None, **kwargs) -> str:
+    """
+    Queue fn for the current Streamlit session and remember the job id in session_state under key
+    (one list per tab). Returns the job id.
+    Without an explicit priority, a job queued while the session still has unfinished jobs is
+    bulk work (the user is batching edits) and gives way to other sessions' single edits.
+    """
+    import streamlit as st
+    queue = get_queue()
+    # The rate limiter's session id, so jobs and direct calls from one browser session share a turn
+    session_id = rate_limiter.current_session()
+    if priority is None:
+        busy = any(not job.finished for job in queue.jobs_for(session_id))
+        priority = rate_limiter.BULK if busy else rate_limiter.INTERACTIVE
+    job_id = queue.submit(session_id, label, fn, *args, priority=priority, **kwargs)
+    st.session_state.setdefault(_session_key(key), []).append(job_id)
+    return job_id
+
+
+def session_jobs(key: str) -> List[Job]:
+    """This session's jobs for key, newest first. Jobs dropped by retention are forgotten."""
+    import streamlit as st
+    queue = get_queue()
+    job_ids = st.session_state.get(_session_key(key), [])
+    jobs = [job for job in (queue.get(job_id) for job_id in job_ids) if job is not None]
+    st.session_state[_session_key(key)] = [job.job_id for job in jobs]
+    return list(reversed(jobs))
+
+
+def render_jobs(key: str, render_result: Callable[[Job], None], poll_seconds: float = JOB_POLL_SECONDS):
+    """
+    Show the status of this session's jobs for key and render finished results with render_result.
+    While jobs are pending the list refreshes itself every poll_seconds without rerunning the page.
+    """
+    import streamlit as st
+
+    def body():
+        jobs = session_jobs(key)
+        for job in jobs:
+            if job.status == DONE:
+                st.caption(f"{job.label} - done in {job.elapsed:.1f}s")
+                render_result(job)
+            elif job.status == FAILED:
+                st.error(f"{job.label} - failed after {job.elapsed:.1f}s: {job.error}")
+            elif job.status == RUNNING:
+                st.info(f"{job.label} - running for {job.elapsed:.0f}s")
+            else:
+                st.info(f"{job.label} - {job.status}")
+        pending = [job for job in jobs if not job.finished]
+        if pending:
+            st.caption(f"Job workers: {get_queue().stats().summary()}")
+        elif jobs and st.session_state.get(f"_jobs_polling_{key}"):
+            # Everything finished while polling; rerun once so the page stops refreshing
+            st.session_state[f"_jobs_polling_{key}"] = False
+            st.rerun()
+        if jobs and not pending and st.button("Clear finished jobs", key=f"_jobs_clear_{key}"):
+            for job in jobs:
+                get_queue().forget(job.job_id)
+            st.session_state[_session_key(key)] = []
+            st.rerun()
+
+    pending = any(not job.finished for job in session_jobs(key))
+    if pending and hasattr(st, "fragment"):
+        st.session_state[f"_jobs_polling_{key}"] = True
+        st.fragment(body, run_every=poll_seconds)()
+    else:
+        body()
+        if pending:
+            # Older Streamlit without fragments: poll manually
+            st.button("Refresh job status", key=f"_jobs_refresh_{key}")
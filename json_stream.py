@@ -0,0 +1,121 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
+
+Path = Tuple[Union[str, int], ...]
+FieldEvent = Tuple[Path, Any]
+
+_PRIMITIVE_END = ",}] \t\r\n"
+
+
+@dataclass
+class _Frame:
+    kind: str  # "object" or "array"
+    path: Path
+    start: int
+    key: Optional[str] = None
+    index: int = 0
+    expect_key: bool = True
+
+    def slot(self) -> Path:
+        return self.path + ((self.key,) if self.kind == "object" else (self.index,))
+
+
+class IncrementalJSONParser:
+    """
+    Parse the first JSON object in a text that arrives in pieces, such as a streamed
+    model response wrapped in ```json fences. Every value is reported by feed() with
+    its path (e.g. ("images", 0, "subject_type")) as soon as it is complete.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._string_start: Optional[int] = None
+        self._string_is_key = False
+        self._escape = False
+        self._primitive_start: Optional[int] = None
+        self.done = False
+        self.result: Any = None
+
+    def feed(self, text: str) -> List[FieldEvent]:
+        """Add text and return the values completed by it, innermost first"""
+        events = []
+        self._buffer += text
+        while self._pos < len(self._buffer) and not self.done:
+            self._step(self._buffer[self._pos], self._pos, events)
+            self._pos += 1
+        return events
+
+    def _complete(self, path: Path, start: int, end: int, events: List[FieldEvent]):
+        value = json.loads(self._buffer[start:end])
+        events.append((path, value))
+        if self._stack:
+            self._stack[-1].expect_key = False
+        else:
+            self.result = value
+            self.done = True
+
+    def _step(self, c: str, i: int, events: List[FieldEvent]):
+        if self._string_start is not None:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                start, self._string_start = self._string_start, None
+                if self._string_is_key:
+                    frame = self._stack[-1]
+                    frame.key = json.loads(self._buffer[start:i + 1])
+                    frame.expect_key = False
+                else:
+                    self._complete(self._stack[-1].slot(), start, i + 1, events)
+            return
+
+        if self._primitive_start is not None:
+            if c not in _PRIMITIVE_END:
+                return
+            start, self._primitive_start = self._primitive_start, None
+            self._complete(self._stack[-1].slot(), start, i, events)
+
+        if not self._stack:
+            # Skip any text before the object, e.g. a ```json fence
+            if c == "{":
+                self._stack.append(_Frame("object", (), i))
+            return
+
+        frame = self._stack[-1]
+        if c in " \t\r\n:":
+            return
+        if c == '"':
+            self._string_start = i
+            self._string_is_key = frame.kind == "object" and frame.expect_key
+        elif c in "{[":
+            self._stack.append(_Frame("object" if c == "{" else "array", frame.slot(), i))
+        elif c in "}]":
+            self._stack.pop()
+            self._complete(frame.path, frame.start, i + 1, events)
+        elif c == ",":
+            if frame.kind == "object":
+                frame.expect_key = True
+            else:
+                frame.index += 1
+        else:
+            self._primitive_start = i
+
+
+def parse_stream(pieces: Iterable[str],
+                 on_field: Optional[Callable[[Path, Any], None]] = None) -> Any:
+    """
+    Consume streamed text, call on_field(path, value) for each completed value
+    and return the parsed object
+    """
+    parser = IncrementalJSONParser()
+    for piece in pieces:
+        for path, value in parser.feed(piece):
+            if on_field is not None:
+                on_field(path, value)
+    if not parser.done:
+        raise ValueError("Response ended before the JSON object was complete")
+    return parser.result
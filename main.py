@@ -1,17 +1,10 @@
+import importlib
 import streamlit as st
-import generator
-import edit
-import controlled_editing
-import product_editing
+from app_tabs import TABS
 
 st.set_page_config(layout="wide")
-tab1, tab2, tab3, tab4 = st.tabs(["Generate Image", "Product Editing(Subject Editing)", "Editing with Mask", "Editing with Gemini"])
-
-with tab1:
-    generator.main()  # app2.py의 run_app2 함수 호출
-with tab2:
-    product_editing.main()
-with tab3:
-    edit.main()
-with tab4:
-    controlled_editing.main()
+# st.tabs would run every tab's body on every rerun; a selector runs only the chosen one,
+# so a tab module (and the SDKs it uses) is imported the first time it is opened
+selected = st.radio("Tab", [label for label, _ in TABS], horizontal=True,
+                    label_visibility="collapsed", key="selected_tab")
+importlib.import_module(dict(TABS)[selected]).main()
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from typing import Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROJECT_ID = os.environ.get("PROJECT_ID")
+LOCATION = os.environ.get("LOCATION")
+
+IMAGEN2_MODEL = "imagegeneration@006"
+IMAGEN3_MODEL = "imagen-3.0-generate-001"
+
+_init_lock = threading.Lock()
+_initialized = False
+
+_models: Dict[tuple, object] = {}
+_load_seconds: Dict[str, float] = {}
+_model_locks: Dict[tuple, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def init_vertexai():
+    """Run vertexai.init() once per process, on first use"""
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            import vertexai
+            started = time.perf_counter()
+            vertexai.init(project=PROJECT_ID, location=LOCATION)
+            _load_seconds["vertexai.init"] = time.perf_counter() - started
+            _initialized = True
+
+
+def _get_or_load(kind: str, name: str, loader):
+    key = (kind, name)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _model_locks.setdefault(key, threading.Lock())
+    # Per-model lock so a slow load does not block other models
+    with lock:
+        model = _models.get(key)
+        if model is None:
+            init_vertexai()
+            started = time.perf_counter()
+            model = loader(name)
+            _load_seconds[name] = time.perf_counter() - started
+            _models[key] = model
+    return model
+
+
+def _load_image_model(name):
+    from vertexai.preview.vision_models import ImageGenerationModel
+    return ImageGenerationModel.from_pretrained(name)
+
+
+def _load_generative_model(name):
+    from vertexai.preview.generative_models import GenerativeModel
+    return GenerativeModel(name)
+
+
+def get_image_model(name: str):
+    """Shared ImageGenerationModel handle, built lazily on first use"""
+    return _get_or_load("image", name, _load_image_model)
+
+
+def get_generative_model(name: str):
+    """Shared GenerativeModel handle, built lazily on first use"""
+    return _get_or_load("generative", name, _load_generative_model)
+
+
+def get_load_times() -> Dict[str, float]:
+    """Seconds spent initializing each model handle (and vertexai.init itself)"""
+    return dict(_load_seconds)
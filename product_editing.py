@@ -1,11 +1,18 @@
 import streamlit as st
 from pathlib import Path
-import tempfile
 import os
 from typing import List
 import base64
-from PIL import Image
 import io
+import copy
+import transport
+import resilience
+import single_flight
+import rate_limiter
+import response_cache
+import upload_ingest
+import image_normalizer
+import job_queue
 
 from imagen_editor import (
     ImageInfo, 
@@ -14,14 +21,9 @@ from imagen_editor import (
     save_images
 )
 
-def save_uploaded_file(uploaded_file) -> str:
-    """Save uploaded file and return the path"""
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-        tmp.write(uploaded_file.getvalue())
-        return tmp.name
-
 def display_image(image_data: bytes):
     """Display image from bytes data"""
+    from PIL import Image
     img = Image.open(io.BytesIO(image_data))
     st.image(img)
 
@@ -44,17 +46,19 @@ def main():
         accept_multiple_files=True
     )
 
+    # Each upload is stored once per session and removed when it leaves the uploader
+    uploads = upload_ingest.ingest_uploads(uploaded_files, "product_uploader")
+
     if uploaded_files:
         # Create columns to display uploaded images
         cols = st.columns(len(uploaded_files))
         image_infos = []
 
-        # Save and display uploaded images
-        for idx, uploaded_file in enumerate(uploaded_files):
+        # Display uploaded images
+        for idx, (uploaded_file, upload) in enumerate(zip(uploaded_files, uploads)):
             with cols[idx]:
                 st.image(uploaded_file, caption=f"Product {idx + 1}")
-                temp_path = save_uploaded_file(uploaded_file)
-                image_infos.append(ImageInfo(path=temp_path))
+                image_infos.append(ImageInfo(path=upload.path))
 
         # Always show editable fields for each image
         st.subheader("Product Information")
@@ -81,12 +85,30 @@ def main():
             "Create a modern minimalist background for these products"
         )
 
+        fresh_sample = st.checkbox("Fresh Gemini sample", value=False, key="product_fresh_sample")
+
         # Analysis button
         if st.button("Analyze Images & Generate Background"):
             with st.spinner("Analyzing images with Gemini..."):
                 try:
+                    # Fields are shown as soon as Gemini finishes writing each of them
+                    streamed_fields = st.container()
+                    placeholders = {}
+
+                    def show_field(path, value):
+                        if len(path) == 3 and path[0] == "images":
+                            label = f"Product {path[1] + 1} {path[2].replace('_', ' ')}"
+                        elif len(path) == 1 and path[0] in ("positive_prompt", "negative_prompt"):
+                            label = path[0].replace('_', ' ').capitalize()
+                        else:
+                            return
+                        if path not in placeholders:
+                            placeholders[path] = streamed_fields.empty()
+                        placeholders[path].markdown(f"**{label}**: {value}")
+
                     # Get analysis and prompts from Gemini
-                    st.session_state.gemini_result = call_gemini_for_editing(image_infos, user_prompt)
+                    st.session_state.gemini_result = call_gemini_for_editing(
+                        image_infos, user_prompt, fresh=fresh_sample, on_field=show_field)
                     st.session_state.analysis_done = True
                     st.rerun()
                 except Exception as e:
@@ -111,31 +133,43 @@ def main():
 
         # Always show generate button if analysis is done
         if st.session_state.analysis_done:
+            bypass_cache = st.checkbox("Bypass response cache", value=False, key="product_bypass_cache")
             if st.button("Generate Final Image", key="generate_final"):
-                with st.spinner("Generating background with Imagen..."):
-                    try:
-                        # Generate the background image
-                        generated_images = product_editing(st.session_state.gemini_result)
-
-                        # Display results
-                        st.subheader("Generated Results")
-                        for idx, img_data in enumerate(generated_images):
-                            st.write(f"Result {idx + 1}")
-                            display_image(img_data)
-
-                            # Add download button for each image
-                            btn = st.download_button(
-                                label=f"Download Result {idx + 1}",
-                                data=img_data,
-                                file_name=f"generated_result_{idx}.png",
-                                mime="image/png"
-                            )
-                    except Exception as e:
-                        st.error(f"An error occurred: {str(e)}")
-                        st.exception(e)
+                # Runs on the background job queue; a snapshot of the edited prompts is used,
+                # so later edits and reruns do not affect a job that is already queued
+                job_queue.submit(
+                    "product_editing",
+                    f"Background: {st.session_state.gemini_result.positive_prompt[:40]}",
+                    product_editing,
+                    copy.deepcopy(st.session_state.gemini_result),
+                    use_cache=not bypass_cache
+                )
+
+            def show_results(job):
+                for idx, img_data in enumerate(job.result):
+                    st.write(f"Result {idx + 1}")
+                    display_image(img_data)
+
+                    # Add download button for each image
+                    st.download_button(
+                        label=f"Download Result {idx + 1}",
+                        data=img_data,
+                        file_name=f"generated_result_{idx}.png",
+                        mime="image/png",
+                        key=f"download_{job.job_id}_{idx}"
+                    )
+
+            st.subheader("Generated Results")
+            job_queue.render_jobs("product_editing", show_results)
 
         # Cleanup temporary files
-        st.sidebar.write("Note: Temporary files will be cleaned up when you close the app.")
+        st.sidebar.write("Note: Uploaded files are cleaned up when removed or when the session ends.")
+        st.sidebar.caption(f"Imagen transport - {transport.get_stats().summary()}")
+        st.sidebar.caption(f"Response cache - {response_cache.get_stats().summary()}")
+        st.sidebar.caption(f"Retries - {resilience.get_stats().summary()}")
+        st.sidebar.caption(f"Coalesced calls - {single_flight.summary()}")
+        st.sidebar.caption(f"Rate limits - {rate_limiter.summary()}")
+        st.sidebar.caption(f"Upload size - {image_normalizer.get_stats().summary()}")
 
 if __name__ == "__main__":
     st.set_page_config(
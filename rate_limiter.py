@@ -0,0 +1,271 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuration variables (requests per minute per endpoint; 0 disables the limit)
+RATE_LIMIT_PREDICT_RPM = float(os.getenv("RATE_LIMIT_PREDICT_RPM", "60"))  # each Imagen capability :predict URL
+RATE_LIMIT_IMAGE_MODEL_RPM = float(os.getenv("RATE_LIMIT_IMAGE_MODEL_RPM", "60"))  # each ImageGenerationModel
+RATE_LIMIT_GEMINI_RPM = float(os.getenv("RATE_LIMIT_GEMINI_RPM", "300"))  # each Gemini model
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "5"))
+WAIT_WINDOW = 500  # recent queue waits kept per endpoint for percentiles
+
+# Priority classes; lower values are served first
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+class QueueTimeout(TimeoutError):
+    """No rate-limit slot became free before the caller's timeout"""
+
+
+_session_var = contextvars.ContextVar("rate_limit_session", default=None)
+_priority_var = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def context(session_id: str, priority: int = INTERACTIVE):
+    """Attribute the calls made inside the block (and on executors it hands work to) to a session"""
+    session_token = _session_var.set(session_id)
+    priority_token = _priority_var.set(priority)
+    try:
+        yield
+    finally:
+        _session_var.reset(session_token)
+        _priority_var.reset(priority_token)
+
+
+def capture_context() -> contextvars.Context:
+    """
+    Copy of the current context with the session resolved, for work handed to another thread
+    (the Streamlit session cannot be looked up from there)
+    """
+    ctx = contextvars.copy_context()
+    if ctx.get(_session_var) is None:
+        ctx.run(_session_var.set, current_session())
+    return ctx
+
+
+def current_session() -> str:
+    """
+    Session the current calls are attributed to: the explicit context if one is set, else the
+    Streamlit session of the script thread (the same id job_queue files jobs under)
+    """
+    session_id = _session_var.get()
+    if session_id is not None:
+        return session_id
+    try:
+        # Called from a Streamlit script thread without an explicit context
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx is not None:
+            return ctx.session_id
+    except Exception:
+        pass
+    return "default"
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst tokens"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self) -> float:
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+
+@dataclass
+class _Ticket:
+    session_id: str
+    priority: int
+    enqueued_at: float
+
+
+@dataclass
+class LimiterStats:
+    endpoint: str
+    granted: int
+    waiting: int
+    wait_p50: float
+    wait_p95: float
+    wait_max: float
+    by_priority: Dict[str, int]
+    timeouts: int = 0
+
+    def summary(self) -> str:
+        return (f"{self.endpoint}: {self.granted} granted, {self.waiting} waiting, {self.timeouts} timed out, "
+                f"wait p50 {self.wait_p50:.2f}s / p95 {self.wait_p95:.2f}s / max {self.wait_max:.2f}s")
+
+
+class FairLimiter:
+    """
+    Token-bucket limiter for one endpoint with a fair wait queue: higher priority classes
+    are served first, and within a class sessions take turns, so one heavy session
+    cannot starve the others.
+    """
+
+    def __init__(self, endpoint: str, rate_per_minute: float, burst: float = RATE_LIMIT_BURST):
+        self.endpoint = endpoint
+        self._bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self._cond = threading.Condition()
+        # priority -> session -> that session's waiting tickets; session order is the round robin
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Ticket]]"] = {}
+        self._waits: Deque[float] = deque(maxlen=WAIT_WINDOW)
+        self._granted = 0
+        self._granted_by_priority: Dict[int, int] = {}
+        self._timeouts = 0
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                return next(iter(sessions.values()))[0]
+        return None
+
+    def _remove(self, ticket: _Ticket):
+        sessions = self._queues[ticket.priority]
+        tickets = sessions[ticket.session_id]
+        tickets.remove(ticket)
+        # The session goes to the back of the round robin after being served
+        del sessions[ticket.session_id]
+        if tickets:
+            sessions[ticket.session_id] = tickets
+        if not sessions:
+            del self._queues[ticket.priority]
+
+    def acquire(self, session_id: Optional[str] = None, priority: Optional[int] = None,
+                timeout: Optional[float] = None) -> float:
+        """
+        Block until this caller's turn comes and a token is available. Returns the seconds waited.
+        Raises QueueTimeout, leaving the queue, if that takes longer than timeout seconds.
+        """
+        ticket = _Ticket(session_id or current_session(),
+                         _priority_var.get() if priority is None else priority,
+                         time.monotonic())
+        deadline = None if timeout is None else ticket.enqueued_at + timeout
+        with self._cond:
+            self._queues.setdefault(ticket.priority, OrderedDict()) \
+                .setdefault(ticket.session_id, deque()).append(ticket)
+            try:
+                while True:
+                    if self._next_ticket() is ticket and self._bucket.try_take():
+                        break
+                    wait_for = self._bucket.time_until_token() if self._next_ticket() is ticket else None
+                    if deadline is not None:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            self._timeouts += 1
+                            raise QueueTimeout(f"no {self.endpoint} slot within {timeout:.1f}s")
+                        wait_for = left if wait_for is None else min(wait_for, left)
+                    self._cond.wait(wait_for)
+            except BaseException:
+                self._remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._remove(ticket)
+            waited = time.monotonic() - ticket.enqueued_at
+            self._waits.append(waited)
+            self._granted += 1
+            self._granted_by_priority[ticket.priority] = self._granted_by_priority.get(ticket.priority, 0) + 1
+            # Wake the new head of the queue so it can wait for the next token
+            self._cond.notify_all()
+        return waited
+
+    def try_acquire(self) -> bool:
+        """Take a token only if nobody is waiting and one is available (used for optional hedges)"""
+        with self._cond:
+            if self._next_ticket() is None and self._bucket.try_take():
+                self._granted += 1
+                return True
+            return False
+
+    def stats(self) -> LimiterStats:
+        with self._cond:
+            waits = sorted(self._waits)
+            waiting = sum(len(tickets) for sessions in self._queues.values() for tickets in sessions.values())
+            by_priority = {PRIORITY_NAMES.get(p, str(p)): n for p, n in self._granted_by_priority.items()}
+            granted = self._granted
+            timeouts = self._timeouts
+
+        def percentile(fraction):
+            return waits[min(len(waits) - 1, int(fraction * len(waits)))] if waits else 0.0
+
+        return LimiterStats(self.endpoint, granted, waiting, percentile(0.5), percentile(0.95),
+                            waits[-1] if waits else 0.0, by_priority, timeouts)
+
+
+def _rate_for(endpoint: str) -> float:
+    kind = endpoint.split(":", 1)[0]
+    return {
+        "predict": RATE_LIMIT_PREDICT_RPM,
+        "model": RATE_LIMIT_IMAGE_MODEL_RPM,
+        "gemini": RATE_LIMIT_GEMINI_RPM,
+    }.get(kind, 0.0)
+
+
+_limiters: Dict[str, Optional[FairLimiter]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint: str) -> Optional[FairLimiter]:
+    """
+    Limiter for endpoint, keyed "predict:<url>", "model:<model name>" or "gemini:<model name>".
+    None when the endpoint kind has no limit configured.
+    """
+    with _limiters_lock:
+        if endpoint not in _limiters:
+            rate = _rate_for(endpoint)
+            _limiters[endpoint] = FairLimiter(endpoint, rate) if rate > 0 else None
+        return _limiters[endpoint]
+
+
+def acquire(endpoint: str, timeout: Optional[float] = None) -> float:
+    """Wait for a request slot on endpoint for the current session and priority"""
+    limiter = get_limiter(endpoint)
+    return limiter.acquire(timeout=timeout) if limiter is not None else 0.0
+
+
+def try_acquire(endpoint: str) -> bool:
+    limiter = get_limiter(endpoint)
+    return limiter.try_acquire() if limiter is not None else True
+
+
+def get_stats() -> List[LimiterStats]:
+    with _limiters_lock:
+        limiters = [limiter for limiter in _limiters.values() if limiter is not None]
+    return [limiter.stats() for limiter in limiters]
+
+
+def summary() -> str:
+    stats = get_stats()
+    if not stats:
+        return "no limited calls yet"
+    # Endpoint URLs are long; show the last path segment
+    return "; ".join(
+        s.summary().replace(s.endpoint, s.endpoint.rsplit("/", 1)[-1]) for s in stats
+    )
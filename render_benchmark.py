@@ -0,0 +1,69 @@
+"""
+Benchmark the single-pass renderer against calling the resize_and_clip_image approach once per output.
+
+    python render_benchmark.py                      # synthetic 2048x2048 JPEG and PNG sources
+    python render_benchmark.py --image photo.jpg --repeat 5
+"""
+import argparse
+import io
+import statistics
+import time
+
+from PIL import Image as PILImage
+
+from image_renderer import AD_LONG_EDGES, ad_specs, center_crop_box, render_derivatives
+
+
+def legacy_render(image_bytes, spec):
+    """Per-output equivalent of generator.resize_and_clip_image: full decode, crop, full-size LANCZOS"""
+    with PILImage.open(io.BytesIO(image_bytes)) as img:
+        img = img.crop(center_crop_box(img.size[0], img.size[1], spec.aspect))
+        img_resized = img.resize(spec.size, PILImage.LANCZOS)
+        output = io.BytesIO()
+        img_resized.save(output, format=spec.format)
+    return output.getvalue()
+
+
+def synthetic_source(format, size=(2048, 2048)):
+    gradient = PILImage.linear_gradient("L").resize(size)
+    img = PILImage.merge("RGB", (gradient, gradient.rotate(90), gradient.rotate(180)))
+    output = io.BytesIO()
+    img.save(output, format=format)
+    return output.getvalue()
+
+
+def time_call(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="source image (default: synthetic JPEG and PNG)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--long-edges", type=int, nargs="+", default=AD_LONG_EDGES,
+                        help="output long-edge sizes for every aspect ratio")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            sources = {args.image: f.read()}
+    else:
+        sources = {"synthetic JPEG": synthetic_source("JPEG"), "synthetic PNG": synthetic_source("PNG")}
+
+    specs = ad_specs(long_edges=args.long_edges)
+    print(f"{len(specs)} outputs: " + ", ".join(spec.name for spec in specs))
+    for label, image_bytes in sources.items():
+        legacy = time_call(lambda: [legacy_render(image_bytes, spec) for spec in specs], args.repeat)
+        single_pass = time_call(lambda: render_derivatives(image_bytes, specs), args.repeat)
+        print(f"\n{label}")
+        print(f"  per-output resize_and_clip: {legacy * 1000:8.1f} ms")
+        print(f"  single-pass renderer:       {single_pass * 1000:8.1f} ms  ({legacy / single_pass:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+import rate_limiter
+
+load_dotenv()
+
+# Configuration variables
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))  # seconds; doubles per attempt
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+CALL_DEADLINE = float(os.getenv("CALL_DEADLINE", "300"))  # seconds for all attempts of one call
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))  # no hedging until the percentile is meaningful
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "16"))  # threads for hedged duplicates only
+LATENCY_WINDOW = 200
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    """A call did not succeed within its deadline"""
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+    deadline: float = CALL_DEADLINE
+    hedge: bool = HEDGE_ENABLED
+    hedge_percentile: float = HEDGE_PERCENTILE
+    hedge_min_samples: int = HEDGE_MIN_SAMPLES
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number attempt (1-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+@dataclass
+class ResilienceStats:
+    calls: int = 0
+    retries: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0  # hedged duplicates that finished first
+    deadline_exceeded: int = 0
+    failures: int = 0
+
+    def summary(self) -> str:
+        return (f"{self.calls} calls, {self.retries} retries, "
+                f"{self.hedges} hedges ({self.hedge_wins} won), "
+                f"{self.deadline_exceeded} deadlines, {self.failures} failures")
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    # requests/httpx errors carry the response; google.api_core errors carry the HTTP code
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Throttling, overload and transient connection errors are retried; everything else is not"""
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        import requests
+        if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+class LatencyTracker:
+    """Recent successful call durations for one operation"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < max(min_samples, 1):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_stats = ResilienceStats()
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Only hedged duplicates run here; primary attempts never queue behind other calls
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="resilience-hedge")
+    return _executor
+
+
+def _start_thread(fn: Callable[[], T]) -> "Future[T]":
+    """Run fn on a thread of its own, so the caller can wait on it alongside a hedge"""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="resilience-attempt", daemon=True).start()
+    return future
+
+
+def get_tracker(name: str) -> LatencyTracker:
+    with _lock:
+        tracker = _trackers.get(name)
+        if tracker is None:
+            tracker = _trackers[name] = LatencyTracker()
+        return tracker
+
+
+def _count(field: str):
+    with _lock:
+        setattr(_stats, field, getattr(_stats, field) + 1)
+
+
+def _attempt(name: str, fn: Callable[[], T], policy: RetryPolicy, remaining: float,
+             limit: Optional[str]) -> T:
+    """One attempt bounded by the remaining deadline, plus a duplicate after the hedge threshold"""
+    tracker = get_tracker(name)
+    started = time.monotonic()
+    if limit is not None:
+        # Time spent queued for a rate-limit slot counts against the deadline, and a caller
+        # that runs out of time leaves the queue without sending the request
+        try:
+            rate_limiter.acquire(limit, timeout=remaining)
+        except rate_limiter.QueueTimeout:
+            _count("deadline_exceeded")
+            raise DeadlineExceeded(f"{name} got no {limit} slot within {policy.deadline:.0f}s") from None
+    sent = time.monotonic()
+    remaining -= sent - started
+    if remaining <= 0:
+        _count("deadline_exceeded")
+        raise DeadlineExceeded(f"{name} did not start within {policy.deadline:.0f}s")
+
+    hedge_after = tracker.percentile(policy.hedge_percentile, policy.hedge_min_samples) if policy.hedge else None
+    if hedge_after is None or hedge_after >= remaining:
+        # Nothing to race against, so the attempt runs on the calling thread.
+        # It cannot be interrupted; the deadline is checked again before any retry.
+        result = fn()
+        tracker.record(time.monotonic() - sent)
+        return result
+
+    primary = _start_thread(fn)
+    pending = {primary}
+    done, _ = wait(pending, timeout=hedge_after)
+    # A hedge is optional, so it is sent only if a slot is free right now
+    if not done and (limit is None or rate_limiter.try_acquire(limit)):
+        _count("hedges")
+        pending.add(_get_executor().submit(fn))
+
+    error = None
+    try:
+        while pending:
+            timeout = remaining - (time.monotonic() - sent)
+            if timeout <= 0:
+                break
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The losing request cannot be interrupted; its result is discarded
+                    if future is not primary:
+                        _count("hedge_wins")
+                    tracker.record(time.monotonic() - sent)
+                    return future.result()
+                error = future.exception()
+    finally:
+        # A hedge still queued for a pool thread is never sent once the caller is done
+        for future in pending:
+            future.cancel()
+    if error is not None and not pending:
+        raise error
+    _count("deadline_exceeded")
+    raise DeadlineExceeded(f"{name} did not finish within {policy.deadline:.0f}s")
+
+
+def call(name: str, fn: Callable[[], T], policy: RetryPolicy = DEFAULT_POLICY,
+         limit: Optional[str] = None) -> T:
+    """
+    Run fn with retries on retryable errors (jittered exponential backoff, honoring Retry-After),
+    an overall deadline, and optional hedging. name groups calls for latency tracking.
+    limit names the rate_limiter endpoint every attempt takes a slot from.
+    """
+    _count("calls")
+    deadline = time.monotonic() + policy.deadline
+    attempt = 1
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            return _attempt(name, fn, policy, remaining, limit)
+        except Exception as e:
+            if attempt >= policy.max_attempts or not is_retryable(e):
+                _count("failures")
+                raise
+            delay = _retry_after(e) or policy.backoff(attempt)
+            if time.monotonic() + delay >= deadline:
+                _count("failures")
+                raise
+            print(f"{name}: {e} - retrying in {delay:.1f}s (attempt {attempt + 1}/{policy.max_attempts})")
+            _count("retries")
+            time.sleep(delay)
+            attempt += 1
+
+
+def get_stats() -> ResilienceStats:
+    with _lock:
+        return ResilienceStats(_stats.calls, _stats.retries, _stats.hedges, _stats.hedge_wins,
+                               _stats.deadline_exceeded, _stats.failures)
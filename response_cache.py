@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+import single_flight
+
+load_dotenv()
+
+# Configuration variables
+PREDICT_CACHE_ENABLED = os.getenv("PREDICT_CACHE_ENABLED", "true").lower() == "true"
+PREDICT_CACHE_DIR = os.getenv("PREDICT_CACHE_DIR", os.path.join(".cache", "predict"))
+PREDICT_CACHE_MAX_BYTES = int(os.getenv("PREDICT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def _normalize(obj: Any) -> Any:
+    """Replace image payloads with their content hashes so the key is small and path independent"""
+    if hasattr(obj, "iter_base64"):
+        return {"sha256": obj.content_hash}
+    if isinstance(obj, dict):
+        return {key: _normalize(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(item) for item in obj]
+    return obj
+
+
+def request_key(endpoint_uri: str, request_data: dict) -> str:
+    normalized = json.dumps(
+        {"endpoint": endpoint_uri, "request": _normalize(request_data)},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def summary(self) -> str:
+        return f"{self.hits} hits / {self.misses} misses"
+
+
+class ResponseCache:
+    """
+    Content-addressed disk cache for :predict responses.
+    Entries are evicted least-recently-used first once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, directory: str = PREDICT_CACHE_DIR, max_bytes: int = PREDICT_CACHE_MAX_BYTES,
+                 enabled: bool = PREDICT_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                response = json.load(f)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            with self._lock:
+                self._stats.misses += 1
+            return None
+        with self._lock:
+            self._stats.hits += 1
+        return response
+
+    def put(self, key: str, response: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(response, f)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self._stats.evictions += 1
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._stats.hits, self._stats.misses, self._stats.evictions)
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ResponseCache()
+    return _default_cache
+
+
+def cached_predict(endpoint_uri: str, request_data: dict, predict, use_cache: bool = True) -> dict:
+    """
+    Return a cached response for request_data, or call predict() and store its result.
+    Identical requests already in flight (from any session) are joined instead of sent again.
+    use_cache=False bypasses both, so the caller always gets a response of its own.
+    """
+    if not use_cache:
+        return predict()
+    cache = get_cache()
+    key = request_key(endpoint_uri, request_data)
+    if not cache.enabled:
+        return single_flight.do("predict-uncached", key, predict)
+
+    def lookup_or_predict():
+        response = cache.get(key)
+        if response is None:
+            response = predict()
+            if "predictions" in response:
+                cache.put(key, response)
+        return response
+
+    return single_flight.do("predict", key, lookup_or_predict)
+
+
+def get_stats() -> CacheStats:
+    return get_cache().stats()
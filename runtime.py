@@ -0,0 +1,113 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+import rate_limiter
+
+load_dotenv()
+
+# Configuration variables
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "8"))  # shared by every session in the process
+
+
+@dataclass
+class RuntimeStats:
+    workers: int
+    active: int  # jobs currently running on a worker thread
+    queued: int  # jobs waiting for a free worker
+
+    def summary(self) -> str:
+        return f"{self.active}/{self.workers} workers busy, {self.queued} queued"
+
+
+class SharedExecutor(concurrent.futures.ThreadPoolExecutor):
+    """ThreadPoolExecutor that reports how many jobs are running and waiting"""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "imagen-worker"):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.max_workers = max_workers
+        self._count_lock = threading.Lock()
+        self._submitted = 0
+        self._started = 0
+        self._finished = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._count_lock:
+            self._submitted += 1
+
+        def run():
+            with self._count_lock:
+                self._started += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._count_lock:
+                    self._finished += 1
+
+        # Rate limiting is per session and priority; keep both when the job changes threads
+        future = super().submit(rate_limiter.capture_context().run, run)
+        future.add_done_callback(self._count_cancelled)
+        return future
+
+    def _count_cancelled(self, future):
+        # A cancelled job never reaches run(); stop counting it as queued
+        if future.cancelled():
+            with self._count_lock:
+                self._started += 1
+                self._finished += 1
+
+    def stats(self) -> RuntimeStats:
+        with self._count_lock:
+            return RuntimeStats(
+                workers=self.max_workers,
+                active=self._started - self._finished,
+                queued=self._submitted - self._started
+            )
+
+
+_executor: Optional[SharedExecutor] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def get_executor() -> SharedExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = SharedExecutor(WORKER_THREADS)
+    return _executor
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the long-lived event loop, starting its background thread on first use"""
+    global _loop
+    if _loop is None:
+        executor = get_executor()
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(executor)
+                threading.Thread(target=loop.run_forever, name="imagen-event-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def submit(coro) -> concurrent.futures.Future:
+    """Schedule a coroutine on the background loop and return a concurrent Future"""
+    # The task runs in a copy of the caller's context, so rate-limit attribution follows it
+    return rate_limiter.capture_context().run(asyncio.run_coroutine_threadsafe, coro, get_loop())
+
+
+def run(coro, timeout: Optional[float] = None):
+    """Run a coroutine on the background loop and block until it finishes"""
+    return submit(coro).result(timeout)
+
+
+def get_stats() -> RuntimeStats:
+    return get_executor().stats()
@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class FlightStats:
+    executed: int = 0  # upstream calls actually made
+    coalesced: int = 0  # calls that waited for an identical call already in flight
+
+    def summary(self) -> str:
+        return f"{self.executed} upstream, {self.coalesced} coalesced"
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one upstream call; every caller
+    gets the leader's result (or exception). Once the call finishes the key is released,
+    so later calls run again (caching is left to the caller).
+    Results are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Future] = {}
+        self._stats: Dict[str, FlightStats] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, namespace: str, key: str) -> Tuple[Future, bool]:
+        """Return the flight for key and whether the caller leads it (and must call finish())"""
+        flight_key = f"{namespace}:{key}"
+        with self._lock:
+            stats = self._stats.setdefault(namespace, FlightStats())
+            future = self._flights.get(flight_key)
+            if future is not None:
+                stats.coalesced += 1
+                return future, False
+            future = self._flights[flight_key] = Future()
+            stats.executed += 1
+            return future, True
+
+    def finish(self, namespace: str, key: str, future: Future, result: Any = None,
+               error: BaseException = None):
+        with self._lock:
+            self._flights.pop(f"{namespace}:{key}", None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, namespace: str, key: str, fn: Callable[[], T]) -> T:
+        future, leader = self.claim(namespace, key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(namespace, key, future, error=e)
+            raise
+        self.finish(namespace, key, future, result)
+        return result
+
+    def stats(self) -> Dict[str, FlightStats]:
+        with self._lock:
+            return {namespace: FlightStats(s.executed, s.coalesced) for namespace, s in self._stats.items()}
+
+
+_default_group = SingleFlight()
+
+
+def get_group() -> SingleFlight:
+    return _default_group
+
+
+def do(namespace: str, key: str, fn: Callable[[], T]) -> T:
+    """Run fn, or wait for the identical call (same namespace and key) already in flight"""
+    return _default_group.do(namespace, key, fn)
+
+
+def get_stats() -> Dict[str, FlightStats]:
+    return _default_group.stats()
+
+
+def summary() -> str:
+    stats = get_stats()
+    if not stats:
+        return "no calls yet"
+    return ", ".join(f"{namespace}: {s.summary()}" for namespace, s in sorted(stats.items()))
@@ -1,11 +1,25 @@
 from dotenv import load_dotenv
 from pprint import pprint
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional
+import asyncio
+import time
 import os
-import json
 import base64
-import requests
-from vertexai.preview.vision_models import ImageGenerationModel, Image
-from vertexai.preview.generative_models import GenerativeModel, Part
+import credentials
+import transport
+import resilience
+import runtime
+import rate_limiter
+import response_cache
+import image_normalizer
+from streaming_body import iter_json
+from encoded_asset import get_asset
+from gemini_images import prepare_for_gemini
+import structured_output
+
+if TYPE_CHECKING:
+    from vertexai.preview.vision_models import Image
 
 
 load_dotenv()
@@ -13,7 +27,8 @@ load_dotenv()
 # Configuration variables (replace with your actual values)
 REGION = "us-central1"
 CLOUD_PROJECT_ID = os.getenv("PROJECT_ID")
-ENDPOINT_URI_PREFIX = f"https://{REGION}-preprod-aiplatform.googleapis.com" # Note the {} for formatting
+# IMAGEN_ENDPOINT_PREFIX can point at standin_server.py to tune retry/hedging policies offline
+ENDPOINT_URI_PREFIX = os.getenv("IMAGEN_ENDPOINT_PREFIX", f"https://{REGION}-preprod-aiplatform.googleapis.com") # Note the {} for formatting
 
 SUBJECT_IMG_FILENAME = "/Users/markpark/Devel/streamlit-imagen-demo/imagen3_image2.png"  # Path to the subject image
 SUBJECT_IMG_DESCRIPTION = "a model walking with yellow shirts"  # Description of the subject
@@ -21,6 +36,7 @@ SUBJECT_IMG_DESCRIPTION = "a model walking with yellow shirts"  # Description of
 #TEXT_PROMPT_TEMPLATE = "Create an image about [1] in the pose of control image [2] to match the description: A pencil style sketch of a full-body portrait of [1] with hatch-cross drawing, hatch drawing of portrait with 6B and graphite pencils, white background, pencil drawing, high quality, pencil stroke, looking at camera, natural human eyes"  # Template for prompt
 TEXT_PROMPT_TEMPLATE = "Create an image about [1] in the pose of control image to match the description: [1] looking at camera, natural human eyes"  # Template for prompt
 NEG_TEXT_PROMPT = "wrinkles, noise, Low quality, dirty, ugly, low res, multi face, nsfw, nude, rough texture, messy, messy background, weird hair, chinese clothes, chinese hair, traditional asia clothes, color background, photo realistic, photo, super realistic, signature, autograph, sign, text, characters, alphabet, letter"
+EDIT_CONCURRENCY = int(os.getenv("EDIT_CONCURRENCY", "4"))  # max concurrent edits in a batch
 ENDPOINT_URI = f"{ENDPOINT_URI_PREFIX.format(REGION)}/v1/projects/{CLOUD_PROJECT_ID}/locations/{REGION}/publishers/google/models/imagen-3.0-capability-001:predict"
 
 def remove_reference_image(obj):
@@ -63,15 +79,16 @@ def print_request_data(request_data):
 
 
 def extract_json_value(json_str):
-    start_index = json_str.find('```json') + 7
-    end_index = json_str.find('```', start_index)
-    json_str = json_str[start_index:end_index].strip()
-    return json.loads(json_str)
-
-def call_gemini_for_editing(image_path, prompt):
-    image1 = Part.from_data(
-        mime_type="image/png",
-        data=encode_image(image_path))
+    # Tolerates a missing or unclosed ```json fence and surrounding text
+    return structured_output.parse_json(json_str)
+
+def call_gemini_for_editing(image_path, prompt, fresh=False, on_field=None):
+    """
+    Ask Gemini for edit parameters. With on_field, the response is streamed and
+    on_field(path, value) is called as each JSON field completes.
+    """
+    # Downsampled copy with its real MIME type; the edit request sends the full asset
+    image1 = prepare_for_gemini(get_asset(image_path))
     prompt_template = f"""
 You're an advertising professional utilizing Imagen for ad creation. 
 Generate an English Imagen prompt that will transform the provided image to meet the user's specifications.
@@ -174,37 +191,58 @@ The value of control_type MUST be one of the following: [CONTROL_TYPE_SCRIBBLE,
 }}
 </output>
     """
-    model = GenerativeModel("gemini-1.5-flash")
-    response = model.generate_content(
+    generation_config = {
+        "max_output_tokens": 4192,
+        "temperature": 0.6,
+        "top_p": 0.93,
+        "top_k": 32
+    }
+    # Response schema keeps the enums within what the editing tab can select
+    return structured_output.generate_json(
+        "gemini-1.5-flash",
         [image1, prompt_template],
-        generation_config={
-            "max_output_tokens": 4192,
-            "temperature": 0.6,
-            "top_p": 0.93,
-            "top_k": 32
-        }
+        generation_config,
+        structured_output.EDIT_PARAMETERS_SCHEMA,
+        fresh=fresh,
+        on_field=on_field
     )
-    return extract_json_value(response.text)
 
 def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+    return get_asset(image_path).base64
 
 def get_access_token():
-    # You might need to adjust this based on your authentication setup
-    stream = os.popen('gcloud auth print-access-token')  # Get token from gcloud
-    return stream.read().strip()
-
-def make_prediction_request(endpoint_uri, access_token, request_data):
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    response = requests.post(endpoint_uri, headers=headers, json=request_data)
-    response.raise_for_status()  # Raise an exception for bad status codes
-    return response.json()
+    # Cached and refreshed in the background by the shared provider
+    return credentials.get_access_token()
+
+def make_prediction_request(endpoint_uri, access_token, request_data, use_cache=True):
+    # Pooled keep-alive session shared by every tab; raises for bad status codes.
+    # The body is streamed in chunks; each reference image is base64-encoded once per asset.
+    # Reference images are downscaled and re-encoded before sending.
+    request_data, _, _ = image_normalizer.normalize_request(request_data)
+
+    def send(token):
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        # 429/503 are retried with backoff within a deadline; see resilience.py
+        # Every attempt takes a slot from the per-URL rate limiter; see rate_limiter.py
+        return resilience.call(
+            "imagen-predict",
+            lambda: transport.post_stream(endpoint_uri, headers, iter_json(request_data)),
+            limit=f"predict:{endpoint_uri}"
+        )
+
+    # Seeds are fixed, so identical requests are served from the disk cache.
+    return response_cache.cached_predict(
+        endpoint_uri, request_data,
+        # A rejected token is refreshed and the request sent once more
+        lambda: credentials.call_with_token(access_token, send),
+        use_cache=use_cache
+    )
 
 def convert_response_to_image(response):
+    from vertexai.preview.vision_models import Image
     images = []
     if "predictions" in response:  # Check if the key exists
         for i, prediction in enumerate(response["predictions"]):
@@ -229,10 +267,8 @@ def save_images_from_response(response):
     else:
         print("Warning: Response does not contain 'predictions'.")
 
-def controlled_editing(prompt, negative_prompt, reference_image_paths, control_type):
-    print('controlled_editing is progressing.')
-    access_token = get_access_token()
-    reference_images = [encode_image(path) for path in reference_image_paths]
+def build_controlled_request(prompt, negative_prompt, reference_image_paths, control_type):
+    reference_images = [get_asset(path) for path in reference_image_paths]
     reference_images_obj = [
       {
         'referenceType': 'REFERENCE_TYPE_CONTROL',
@@ -260,16 +296,11 @@ def controlled_editing(prompt, negative_prompt, reference_image_paths, control_t
           'promptLanguage': 'en'
       }
     }
-    print_request_data(request_data)
-    response = make_prediction_request(ENDPOINT_URI, access_token, request_data)
-    images = convert_response_to_image(response)
-    return images
+    return request_data
 
 
-def subject_editing(prompt, negative_prompt, subject_image_description, subject_image_paths, subject_type):
-    print('subject_editing is progressing.')
-    access_token = get_access_token()
-    subject_img_b64 = encode_image(subject_image_paths[0])
+def build_subject_request(prompt, negative_prompt, subject_image_description, subject_image_paths, subject_type):
+    subject_img_b64 = get_asset(subject_image_paths[0])
     request_data = {
         "instances": [
             {
@@ -298,15 +329,10 @@ def subject_editing(prompt, negative_prompt, subject_image_description, subject_
             "editMode": "EDIT_MODE_DEFAULT"
         }
     }
-    print_request_data(request_data)
-    response = make_prediction_request(ENDPOINT_URI, access_token, request_data)
-    images = convert_response_to_image(response)
-    return images
+    return request_data
 
-def instruct_editing(prompt, negative_prompt, subject_image_paths, seed):
-    print('instruct_editing is progressing.')
-    access_token = get_access_token()
-    subject_img_b64 = encode_image(subject_image_paths[0])
+def build_instruct_request(prompt, negative_prompt, subject_image_paths, seed):
+    subject_img_b64 = get_asset(subject_image_paths[0])
     parameters = {
             "negativePrompt": negative_prompt,
             "seed": int(seed),
@@ -334,16 +360,10 @@ def instruct_editing(prompt, negative_prompt, subject_image_paths, seed):
         ],
         "parameters": parameters
     }
+    return request_data
 
-    print_request_data(request_data)
-    response = make_prediction_request(ENDPOINT_URI, access_token, request_data)
-    images = convert_response_to_image(response)
-    return images
-
-def default_editing(prompt, negative_prompt, edit_mode, mask_mode, dilation, subject_image_paths, seed, guidance_scale):
-    print('default_editing is progressing.')
-    access_token = get_access_token()
-    subject_img_b64 = encode_image(subject_image_paths[0])
+def build_default_request(prompt, negative_prompt, edit_mode, mask_mode, dilation, subject_image_paths, seed, guidance_scale):
+    subject_img_b64 = get_asset(subject_image_paths[0])
     parameters = {
             "negativePrompt": negative_prompt,
             "seed": int(seed),
@@ -387,16 +407,10 @@ def default_editing(prompt, negative_prompt, edit_mode, mask_mode, dilation, sub
         ],
         "parameters": parameters
     }
+    return request_data
 
-    print_request_data(request_data)
-    response = make_prediction_request(ENDPOINT_URI, access_token, request_data)
-    images = convert_response_to_image(response)
-    return images
-
-def style_editing(prompt, negative_prompt, subject_image_paths, style_description):
-    print('style_editing is progressing.')
-    access_token = get_access_token()
-    subject_img_b64 = encode_image(subject_image_paths[0])
+def build_style_request(prompt, negative_prompt, subject_image_paths, style_description):
+    subject_img_b64 = get_asset(subject_image_paths[0])
     request_data = {
         "instances": [
             {
@@ -423,10 +437,103 @@ def style_editing(prompt, negative_prompt, subject_image_paths, style_descriptio
             "promptLanguage": "en",
         }
     }
+    return request_data
+
+EDIT_REQUEST_BUILDERS = {
+    "controlled": build_controlled_request,
+    "subject": build_subject_request,
+    "instruct": build_instruct_request,
+    "default": build_default_request,
+    "style": build_style_request,
+}
+
+@dataclass
+class EditJob:
+    """One capability-model edit. params are the keyword arguments of the matching build_*_request function."""
+    edit_type: str  # one of EDIT_REQUEST_BUILDERS
+    params: Dict[str, Any]
+    job_id: str = ""
+    use_cache: bool = True
+
+@dataclass
+class EditResult:
+    job: EditJob
+    images: List["Image"] = field(default_factory=list)
+    queued_seconds: float = 0.0  # time spent waiting for a concurrency slot
+    elapsed_seconds: float = 0.0  # time spent building and running the request
+    error: Optional[Exception] = None
+
+def run_edit_job(job: EditJob) -> List["Image"]:
+    """Build and send a single edit request (blocking)"""
+    print(f'{job.edit_type}_editing is progressing.')
+    request_data = EDIT_REQUEST_BUILDERS[job.edit_type](**job.params)
     print_request_data(request_data)
-    response = make_prediction_request(ENDPOINT_URI, access_token, request_data)
-    images = convert_response_to_image(response)
-    return images
+    access_token = get_access_token()
+    response = make_prediction_request(ENDPOINT_URI, access_token, request_data, use_cache=job.use_cache)
+    return convert_response_to_image(response)
+
+async def run_edit_jobs(jobs: List[EditJob], concurrency: int = EDIT_CONCURRENCY) -> AsyncIterator[EditResult]:
+    """
+    Run many edit jobs concurrently, at most `concurrency` at a time.
+    Results are yielded in completion order; failures are returned on the result instead of raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    # A batch of several edits is bulk work: its calls give way to single interactive edits
+    priority = rate_limiter.BULK if len(jobs) > 1 else None
+
+    async def run(job):
+        submitted = time.perf_counter()
+        async with semaphore:
+            started = time.perf_counter()
+            result = EditResult(job=job, queued_seconds=started - submitted)
+            try:
+                if priority is None:
+                    result.images = await loop.run_in_executor(runtime.get_executor(), run_edit_job, job)
+                else:
+                    # Each task has its own context, so this does not leak to the caller
+                    with rate_limiter.context(rate_limiter.current_session(), priority):
+                        result.images = await loop.run_in_executor(runtime.get_executor(), run_edit_job, job)
+            except Exception as e:
+                result.error = e
+            result.elapsed_seconds = time.perf_counter() - started
+            return result
+
+    for next_result in asyncio.as_completed([run(job) for job in jobs]):
+        yield await next_result
+
+async def collect_edit_results(jobs: List[EditJob], concurrency: int = EDIT_CONCURRENCY) -> List[EditResult]:
+    return [result async for result in run_edit_jobs(jobs, concurrency)]
+
+def _run_single_edit(edit_type, use_cache=True, **params):
+    job = EditJob(edit_type, params, use_cache=use_cache)
+    result = runtime.run(collect_edit_results([job], concurrency=1))[0]
+    if result.error is not None:
+        raise result.error
+    return result.images
+
+def controlled_editing(prompt, negative_prompt, reference_image_paths, control_type, use_cache=True):
+    return _run_single_edit("controlled", use_cache, prompt=prompt, negative_prompt=negative_prompt,
+                            reference_image_paths=reference_image_paths, control_type=control_type)
+
+def subject_editing(prompt, negative_prompt, subject_image_description, subject_image_paths, subject_type, use_cache=True):
+    return _run_single_edit("subject", use_cache, prompt=prompt, negative_prompt=negative_prompt,
+                            subject_image_description=subject_image_description,
+                            subject_image_paths=subject_image_paths, subject_type=subject_type)
+
+def instruct_editing(prompt, negative_prompt, subject_image_paths, seed, use_cache=True):
+    return _run_single_edit("instruct", use_cache, prompt=prompt, negative_prompt=negative_prompt,
+                            subject_image_paths=subject_image_paths, seed=seed)
+
+def default_editing(prompt, negative_prompt, edit_mode, mask_mode, dilation, subject_image_paths, seed, guidance_scale, use_cache=True):
+    return _run_single_edit("default", use_cache, prompt=prompt, negative_prompt=negative_prompt,
+                            edit_mode=edit_mode, mask_mode=mask_mode, dilation=dilation,
+                            subject_image_paths=subject_image_paths, seed=seed,
+                            guidance_scale=guidance_scale)
+
+def style_editing(prompt, negative_prompt, subject_image_paths, style_description, use_cache=True):
+    return _run_single_edit("style", use_cache, prompt=prompt, negative_prompt=negative_prompt,
+                            subject_image_paths=subject_image_paths, style_description=style_description)
 
 if __name__ == "__main__":
 
@@ -0,0 +1,175 @@
+"""
+Local stand-in for the Imagen :predict endpoint, for tuning retry, deadline and hedging
+policies offline. Latency is log-normal with an optional slow tail, and a share of requests
+fail with 429 or 503.
+
+    python standin_server.py --port 8765 --latency 1.5 --rate-429 0.1 --slow-rate 0.05
+
+Point the app at it with
+    IMAGEN_ENDPOINT_PREFIX=http://127.0.0.1:8765 TOKEN_SOURCE=fake streamlit run main.py
+
+or drive it directly through the resilience layer and print the outcome:
+    python standin_server.py --drive 50 --concurrency 8
+"""
+import argparse
+import base64
+import io
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _placeholder_png(seed: int) -> str:
+    from PIL import Image as PILImage
+    rng = random.Random(seed)
+    img = PILImage.new("RGB", (64, 64), tuple(rng.randrange(256) for _ in range(3)))
+    output = io.BytesIO()
+    img.save(output, format="PNG")
+    return base64.b64encode(output.getvalue()).decode("ascii")
+
+
+class StandInConfig:
+    def __init__(self, latency: float, sigma: float, slow_rate: float, slow_factor: float,
+                 rate_429: float, rate_503: float, retry_after: float):
+        self.latency = latency
+        self.sigma = sigma
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.retry_after = retry_after
+
+    def sample_latency(self) -> float:
+        seconds = self.latency * math.exp(random.gauss(0, self.sigma))
+        if random.random() < self.slow_rate:
+            seconds *= self.slow_factor
+        return seconds
+
+
+def make_handler(config: StandInConfig):
+    class PredictHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _read_body(self) -> bytes:
+            # transport.post_stream() sends chunked bodies
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        break
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                return b"".join(chunks)
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self._read_body() or b"{}")
+            if not self.path.endswith(":predict"):
+                self._send_json(404, {"error": {"code": 404, "message": f"Unknown path {self.path}"}})
+                return
+            roll = random.random()
+            if roll < config.rate_429:
+                self._send_json(429, {"error": {"code": 429, "message": "Quota exceeded (stand-in)"}},
+                                {"Retry-After": str(config.retry_after)} if config.retry_after else None)
+                return
+            if roll < config.rate_429 + config.rate_503:
+                self._send_json(503, {"error": {"code": 503, "message": "Service unavailable (stand-in)"}})
+                return
+            time.sleep(config.sample_latency())
+            count = int(request.get("parameters", {}).get("sampleCount", 1))
+            seed = int(request.get("parameters", {}).get("seed", 0))
+            self._send_json(200, {"predictions": [
+                {"bytesBase64Encoded": _placeholder_png(seed + i), "mimeType": "image/png"}
+                for i in range(count)
+            ]})
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictHandler
+
+
+def serve(port: int, config: StandInConfig) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="standin-server", daemon=True).start()
+    return server
+
+
+def drive(port: int, calls: int, concurrency: int):
+    import resilience
+    import transport
+    from streaming_body import iter_json
+
+    url = f"http://127.0.0.1:{port}/v1/projects/standin/locations/local/publishers/google/models/standin:predict"
+    headers = {"Content-Type": "application/json"}
+
+    def one(i):
+        request = {"instances": [{"prompt": f"request {i}"}], "parameters": {"sampleCount": 1, "seed": i}}
+        started = time.monotonic()
+        try:
+            resilience.call("standin-predict",
+                            lambda: transport.post_stream(url, headers, iter_json(request)))
+            return time.monotonic() - started, None
+        except Exception as e:
+            return time.monotonic() - started, e
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(calls)))
+    latencies = sorted(seconds for seconds, error in results if error is None)
+    errors = [error for _, error in results if error is not None]
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        print(f"{len(latencies)} ok: p50 {p50:.2f}s, p95 {p95:.2f}s, max {latencies[-1]:.2f}s")
+    print(f"{len(errors)} failed" + (f" (e.g. {errors[0]})" if errors else ""))
+    print(f"Resilience: {resilience.get_stats().summary()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Imagen :predict endpoint")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="median latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.3, help="log-normal spread of the latency")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests in the slow tail")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="latency multiplier for the slow tail")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-503", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--drive", type=int, default=0, help="send this many calls through the resilience layer and exit")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    config = StandInConfig(args.latency, args.sigma, args.slow_rate, args.slow_factor,
+                           args.rate_429, args.rate_503, args.retry_after)
+    server = serve(args.port, config)
+    if args.drive:
+        drive(args.port, args.drive, args.concurrency)
+        server.shutdown()
+        return
+    print(f"Stand-in :predict endpoint on http://127.0.0.1:{args.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
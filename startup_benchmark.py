@@ -0,0 +1,121 @@
+"""
+Cold-start import benchmark for each Streamlit tab.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter per tab,
+subtracts bare interpreter startup, and reports the tab's slowest direct dependencies.
+
+    python startup_benchmark.py
+    python startup_benchmark.py --repeat 5 --top 15 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from app_tabs import TABS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_importtime(stderr: str):
+    """Return [(cumulative_us, self_us, module, depth)] from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us = int(fields[0].strip())
+            cumulative_us = int(fields[1].strip())
+        except ValueError:
+            continue  # header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((cumulative_us, self_us, name.strip(), depth))
+    return rows
+
+
+def direct_imports(rows, module_name: str):
+    """Depth-1 rows imported by module_name (importtime prints children before their parent)"""
+    children = []
+    for row in rows:
+        if row[3] == 1:
+            children.append(row)
+        elif row[3] == 0:
+            if row[2] == module_name:
+                return children
+            children = []
+    return []
+
+
+def run_once(code: str):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=HERE, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return elapsed, parse_importtime(result.stderr)
+
+
+def benchmark_module(module_name: str, repeat: int, baseline: float, startup_modules: set, top: int):
+    walls = []
+    rows = []
+    for _ in range(repeat):
+        elapsed, rows = run_once(f"import {module_name}")
+        walls.append(elapsed)
+    # Ignore what the interpreter imports at startup (site, encodings, ...)
+    top_level = [row for row in rows if row[3] == 0 and row[2] not in startup_modules]
+    # The tab itself is the only top-level import, so rank what it pulls in
+    children = direct_imports(rows, module_name)
+    return {
+        "module": module_name,
+        "wall_ms": round((statistics.median(walls) - baseline) * 1000, 1),
+        "import_ms": round(sum(row[0] for row in top_level) / 1000, 1),
+        "slowest": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1)}
+            for cumulative, _, name, _ in sorted(children, reverse=True)[:top]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per tab; the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    args = parser.parse_args()
+
+    baseline_runs = [run_once("pass") for _ in range(args.repeat)]
+    baseline = statistics.median(elapsed for elapsed, _ in baseline_runs)
+    startup_modules = {row[2] for row in baseline_runs[-1][1]}
+
+    report = {"python": sys.version.split()[0], "baseline_ms": round(baseline * 1000, 1), "tabs": []}
+    for label, module_name in TABS:
+        try:
+            result = benchmark_module(module_name, args.repeat, baseline, startup_modules, args.top)
+        except RuntimeError as e:
+            result = {"module": module_name, "error": str(e)}
+        result["tab"] = label
+        report["tabs"].append(result)
+
+        print(f"\n{label} ({module_name})")
+        if "error" in result:
+            print(f"  failed: {result['error']}")
+            continue
+        print(f"  cold start: {result['wall_ms']} ms (import time {result['import_ms']} ms)")
+        for item in result["slowest"]:
+            print(f"    {item['cumulative_ms']:>8} ms  {item['module']}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
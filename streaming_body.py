@@ -0,0 +1,50 @@
+import json
+import os
+from typing import Any, Iterator
+
+# Configuration variables
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", str(256 * 1024)))  # raw image bytes per streamed chunk
+
+
+def _iter_tokens(obj: Any, chunk_size: int) -> Iterator[bytes]:
+    # Anything that can stream its base64 form (e.g. EncodedAsset)
+    if hasattr(obj, "iter_base64"):
+        yield b'"'
+        yield from obj.iter_base64(chunk_size)
+        yield b'"'
+    elif isinstance(obj, dict):
+        yield b"{"
+        for index, (key, value) in enumerate(obj.items()):
+            if index:
+                yield b","
+            yield json.dumps(str(key)).encode("utf-8") + b":"
+            yield from _iter_tokens(value, chunk_size)
+        yield b"}"
+    elif isinstance(obj, (list, tuple)):
+        yield b"["
+        for index, item in enumerate(obj):
+            if index:
+                yield b","
+            yield from _iter_tokens(item, chunk_size)
+        yield b"]"
+    else:
+        yield json.dumps(obj).encode("utf-8")
+
+
+def iter_json(obj: Any, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Serialize request_data to JSON as a stream of byte chunks.
+    Small tokens are coalesced so each yielded chunk is roughly chunk_size bytes.
+    """
+    buffer = []
+    buffered = 0
+    for token in _iter_tokens(obj, chunk_size):
+        buffer.append(token)
+        buffered += len(token)
+        if buffered >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
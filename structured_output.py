@@ -0,0 +1,191 @@
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+import gemini_cache
+import json_stream
+from gemini_cache import Content
+
+load_dotenv()
+
+# Configuration variables
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "true").lower() == "true"
+
+EDIT_TYPES = ["SUBJECT_EDITING", "STYLE_EDITING", "CONTROLLED_EDITING", "INSTRUCT_EDITING", "EDIT_MODE_DEFAULT"]
+EDIT_MODES = ["EDIT_MODE_INPAINT_INSERTION", "EDIT_MODE_INPAINT_REMOVAL", "EDIT_MODE_OUTPAINT", "NONE"]
+MASK_MODES = ["MASK_MODE_BACKGROUND", "MASK_MODE_FOREGROUND", "NONE"]
+SUBJECT_TYPES = ["SUBJECT_TYPE_PERSON", "SUBJECT_TYPE_ANIMAL", "SUBJECT_TYPE_PRODUCT", "SUBJECT_TYPE_DEFAULT"]
+CONTROL_TYPES = ["CONTROL_TYPE_SCRIBBLE", "CONTROL_TYPE_CANNY"]
+
+# Value used when the model returns something outside an enum
+ENUM_FALLBACKS = {
+    "edit_type": "EDIT_MODE_DEFAULT",
+    "edit_mode": "NONE",
+    "mask_mode": "NONE",
+    "subject_type": "SUBJECT_TYPE_DEFAULT",
+    "control_type": "CONTROL_TYPE_SCRIBBLE",
+}
+
+
+def _string(enum: Optional[List[str]] = None) -> dict:
+    schema = {"type": "STRING"}
+    if enum:
+        schema["enum"] = enum
+    return schema
+
+
+def _object(properties: Dict[str, dict]) -> dict:
+    return {"type": "OBJECT", "properties": properties, "required": list(properties)}
+
+
+# generator.call_gemini(): prompt rewrite
+PROMPT_REWRITE_SCHEMA = _object({
+    "positive": _string(),
+    "negative": _string(),
+})
+
+# imagen_editor.call_gemini_for_editing(): product analysis
+PRODUCT_ANALYSIS_SCHEMA = _object({
+    "images": {
+        "type": "ARRAY",
+        "items": _object({
+            "subject_description": _string(),
+            "subject_type": _string(SUBJECT_TYPES),
+        }),
+    },
+    "positive_prompt": _string(),
+    "negative_prompt": _string(),
+})
+
+# sketchToImage.call_gemini_for_editing(): edit-parameter extraction
+EDIT_PARAMETERS_SCHEMA = _object({
+    "org_image_description": _string(),
+    "main_object_description": _string(),
+    "edit_type": _string(EDIT_TYPES),
+    "edit_mode_selection_reason": _string(),
+    "edit_mode": _string(EDIT_MODES),
+    "mask_mode": _string(MASK_MODES),
+    "subject_type": _string(SUBJECT_TYPES),
+    "positive_prompt": _string(),
+    "negative_prompt": _string(),
+    "guidance_scale": {"type": "NUMBER"},
+    "mask_dilation": {"type": "NUMBER"},
+    "control_type": _string(CONTROL_TYPES),
+})
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+
+def with_schema(generation_config: dict, schema: dict) -> dict:
+    """generation_config plus the JSON response schema, when structured output is enabled"""
+    if not STRUCTURED_OUTPUT:
+        return generation_config
+    return {**generation_config, "response_mime_type": "application/json", "response_schema": schema}
+
+
+def parse_json(text: str) -> Any:
+    """
+    Parse a JSON object from model output: plain JSON, a fenced block (closed or not),
+    the completed fields of a truncated object, or the first decodable object embedded
+    in other text. Raises ValueError if none is found.
+    """
+    candidates = [text]
+    candidates.extend(match.group(1) for match in _FENCE.finditer(text))
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            pass
+
+    # Output cut off by max_output_tokens still has usable leading fields
+    parser = json_stream.IncrementalJSONParser()
+    try:
+        events = parser.feed(text)
+    except ValueError:
+        events = []
+    if parser.done:
+        return parser.result
+    fields = {path[0]: value for path, value in events if len(path) == 1}
+    if fields:
+        return fields
+
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"\{", text):
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+            return value
+        except ValueError:
+            continue
+    raise ValueError(f"No JSON object found in model output: {text[:200]!r}")
+
+
+def _coerce(value: Any, schema: dict, name: str) -> Any:
+    kind = schema.get("type")
+    if kind == "OBJECT":
+        value = value if isinstance(value, dict) else {}
+        result = dict(value)
+        for key, prop in schema.get("properties", {}).items():
+            result[key] = _coerce(value.get(key), prop, key)
+        return result
+    if kind == "ARRAY":
+        items = value if isinstance(value, list) else []
+        return [_coerce(item, schema.get("items", {}), name) for item in items]
+    if kind == "NUMBER":
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if value is None:
+        value = ""
+    value = str(value).strip()
+    enum = schema.get("enum")
+    if enum and value not in enum:
+        # Accept case and separator variants and unprefixed names, e.g. "product"
+        normalized = value.upper().replace(" ", "_").replace("-", "_")
+        matches = [option for option in enum if option == normalized or option.endswith("_" + normalized)]
+        if len(matches) == 1:
+            return matches[0]
+        fallback = ENUM_FALLBACKS.get(name, enum[-1])
+        if value:
+            print(f"Warning: {name}={value!r} is not one of {enum}; using {fallback}")
+        return fallback
+    return value
+
+
+def validate(result: Any, schema: dict) -> Any:
+    """Fill missing fields and replace enum values the UI cannot select with their fallbacks"""
+    return _coerce(result, schema, "")
+
+
+def generate_json(model_name: str, contents: List[Content], generation_config: dict, schema: dict,
+                  fresh: bool = False, on_field: Optional[Callable[[tuple, Any], None]] = None) -> Any:
+    """
+    Call Gemini with a response schema and return the validated object.
+    Malformed output is repaired locally when possible; otherwise it is dropped from
+    the memo cache so the next attempt asks Gemini again.
+    """
+    config = with_schema(generation_config, schema)
+    try:
+        if on_field is not None:
+            stream = gemini_cache.stream_text(model_name, contents, config, fresh=fresh)
+            received = []
+
+            def pieces():
+                for piece in stream:
+                    received.append(piece)
+                    yield piece
+
+            try:
+                result = json_stream.parse_stream(pieces(), on_field)
+            except ValueError:
+                received.extend(stream)
+                result = parse_json("".join(received))
+        else:
+            result = parse_json(gemini_cache.generate_text(model_name, contents, config, fresh=fresh))
+    except ValueError:
+        gemini_cache.forget(model_name, contents, config)
+        raise
+    return validate(result, schema)
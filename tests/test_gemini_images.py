@@ -0,0 +1,41 @@
+import pytest
+
+import gemini_images
+from gemini_images import TOKENS_PER_TILE, estimate_tokens, target_size
+
+SIZES = [(2296, 2296), (2296, 1149), (1149, 2296), (4000, 3000), (5000, 100), (1536, 1536), (800, 600)]
+BUDGETS = [1, 100, 257, 258, 300, 516, 774, 1032, 2064]
+
+
+@pytest.mark.parametrize("max_dimension", [768, 2048, 4096, 8192])
+@pytest.mark.parametrize("width,height", SIZES)
+def test_target_size_terminates_within_limits(width, height, max_dimension):
+    for budget in BUDGETS:
+        w, h = target_size(width, height, max_dimension, budget)
+        assert max(w, h) <= max_dimension
+        assert estimate_tokens(w, h) <= max(budget, TOKENS_PER_TILE)
+
+
+@pytest.mark.parametrize("width,height,budget", [
+    (2296, 2296, 258),  # used to loop forever: 2296 * (1536 / 2296) == 1536.0000000000002
+    (2296, 2296, 516),
+    (2296, 1149, 258),
+])
+def test_target_size_float_drift_regression(width, height, budget):
+    w, h = target_size(width, height, 4096, budget)
+    assert estimate_tokens(w, h) <= budget
+
+
+def test_target_size_without_budget_only_caps_dimension():
+    assert target_size(4000, 2000, 768, 0) == (768, 384)
+    assert target_size(500, 400, 768, 0) == (500, 400)
+
+
+def test_budget_below_one_tile_is_clamped(monkeypatch):
+    monkeypatch.setenv("GEMINI_IMAGE_TOKEN_BUDGET", "10")
+    import importlib
+    try:
+        assert importlib.reload(gemini_images).GEMINI_IMAGE_TOKEN_BUDGET == TOKENS_PER_TILE
+    finally:
+        monkeypatch.delenv("GEMINI_IMAGE_TOKEN_BUDGET")
+        importlib.reload(gemini_images)
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from json_stream import IncrementalJSONParser, parse_stream
+from structured_output import parse_json
+
+DOCUMENT = {
+    "edit_type": "controlled",
+    "prompt": "a \"quoted\" {brace} and a \\ backslash, é",
+    "images": [{"subject_type": "product", "score": 0.5}, {"subject_type": "person", "score": -1e3}],
+    "flags": [True, False, None],
+    "empty": {},
+    "count": 12,
+}
+TEXT = "Sure, here it is:\n```json\n" + json.dumps(DOCUMENT, indent=2) + "\n```\ntrailing text"
+
+
+def split_every(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(TEXT)])
+def test_split_chunks_give_the_same_result(size):
+    assert parse_stream(split_every(TEXT, size)) == DOCUMENT
+
+
+def test_fields_are_reported_with_paths_as_they_complete():
+    parser = IncrementalJSONParser()
+    assert parser.feed('```json\n{"edit_type": "contr') == []
+    assert parser.feed('olled", "images": [{"subject_type"') == [(("edit_type",), "controlled")]
+    events = parser.feed(': "product"}, {"score": 2')
+    assert events == [(("images", 0, "subject_type"), "product"), (("images", 0), {"subject_type": "product"})]
+    # A number is only complete once a delimiter follows it
+    events = parser.feed("}]}")
+    assert events[0] == (("images", 1, "score"), 2)
+    assert parser.done
+    assert parser.result == {"edit_type": "controlled", "images": [{"subject_type": "product"}, {"score": 2}]}
+
+
+def test_text_after_the_object_is_ignored():
+    parser = IncrementalJSONParser()
+    parser.feed('{"a": 1} {"b": 2}')
+    assert parser.result == {"a": 1}
+
+
+def test_parse_stream_rejects_a_truncated_object():
+    with pytest.raises(ValueError):
+        parse_stream(['{"a": 1, "b": [1, 2'])
+
+
+def test_on_field_sees_every_top_level_field():
+    seen = {}
+    parse_stream(split_every(TEXT, 5), on_field=lambda path, value: seen.setdefault(path, value))
+    assert {path[0] for path in seen if len(path) == 1} == set(DOCUMENT)
+
+
+def test_parse_json_keeps_completed_fields_of_a_truncated_response():
+    truncated = '```json\n{"edit_type": "controlled", "prompt": "a cat", "images": [{"subject_type": "pro'
+    result = parse_json(truncated)
+    assert result["edit_type"] == "controlled"
+    assert result["prompt"] == "a cat"
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+import rate_limiter
+import resilience
+import runtime
+from rate_limiter import BULK, INTERACTIVE, FairLimiter, QueueTimeout
+
+
+def drained_limiter(rate_per_minute=1200):
+    limiter = FairLimiter("model:test", rate_per_minute, burst=1)
+    assert limiter.try_acquire()
+    return limiter
+
+
+def enqueue_in_order(limiter, callers):
+    """Start one thread per (session, priority), each queued before the next starts; return the grant order"""
+    order = []
+    lock = threading.Lock()
+    threads = []
+
+    def run(session, priority):
+        limiter.acquire(session, priority)
+        with lock:
+            order.append(session)
+
+    for waiting, (session, priority) in enumerate(callers, start=1):
+        thread = threading.Thread(target=run, args=(session, priority))
+        thread.start()
+        threads.append(thread)
+        deadline = time.monotonic() + 2
+        while limiter.stats().waiting < waiting and time.monotonic() < deadline:
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_bucket_allows_burst_then_paces():
+    limiter = FairLimiter("model:test", 600, burst=3)  # one token per 0.1s
+    assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+    waited = limiter.acquire("s")
+    assert 0.05 < waited < 0.3
+
+
+def test_interactive_is_served_before_bulk():
+    # Tokens arrive every 0.25s, so all callers are queued before the first grant
+    limiter = drained_limiter(240)
+    order = enqueue_in_order(limiter, [("bulk-1", BULK), ("bulk-2", BULK), ("ui", INTERACTIVE)])
+    assert order == ["ui", "bulk-1", "bulk-2"]
+    assert limiter.stats().by_priority == {"interactive": 1, "bulk": 2}
+
+
+def test_sessions_take_turns_within_a_priority():
+    limiter = drained_limiter(240)
+    order = enqueue_in_order(limiter, [("heavy", INTERACTIVE)] * 3 + [("a", INTERACTIVE), ("b", INTERACTIVE)])
+    assert order == ["heavy", "a", "b", "heavy", "heavy"]
+
+
+def test_timeout_leaves_the_queue():
+    limiter = drained_limiter(6)  # one token per 10s
+    with pytest.raises(QueueTimeout):
+        limiter.acquire("s", timeout=0.1)
+    stats = limiter.stats()
+    assert stats.waiting == 0
+    assert stats.timeouts == 1
+
+
+def test_try_acquire_does_not_jump_the_queue():
+    limiter = drained_limiter(240)
+    waiter = threading.Thread(target=limiter.acquire, args=("s", INTERACTIVE))
+    waiter.start()
+    while limiter.stats().waiting == 0:
+        time.sleep(0.001)
+    time.sleep(0.3)  # a token is available, but it belongs to the waiter
+    assert not limiter.try_acquire()
+    waiter.join(2)
+
+
+def test_unlimited_kinds_have_no_limiter():
+    assert rate_limiter.get_limiter("unknown:thing") is None
+    assert rate_limiter.acquire("unknown:thing") == 0.0
+    assert rate_limiter.try_acquire("unknown:thing")
+
+
+def test_context_follows_work_to_the_shared_executor():
+    def attribution():
+        return rate_limiter.current_session(), rate_limiter._priority_var.get()
+
+    async def on_loop():
+        return attribution()
+
+    with rate_limiter.context("session-1", BULK):
+        assert runtime.get_executor().submit(attribution).result(5) == ("session-1", BULK)
+        assert runtime.run(on_loop(), timeout=5) == ("session-1", BULK)
+    assert rate_limiter._priority_var.get() == INTERACTIVE
+
+
+def test_queued_calls_past_their_deadline_are_never_sent(monkeypatch):
+    monkeypatch.setitem(rate_limiter._limiters, "model:deadline-test", drained_limiter(60))
+    sent = []
+    results = []
+
+    def caller():
+        try:
+            resilience.call("deadline-test", lambda: sent.append(1),
+                            resilience.RetryPolicy(deadline=0.5, hedge=False), limit="model:deadline-test")
+            results.append("ok")
+        except resilience.DeadlineExceeded:
+            results.append("deadline")
+
+    threads = [threading.Thread(target=caller) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["deadline"] * 3
+    assert sent == []
@@ -0,0 +1,133 @@
+import time
+
+import pytest
+
+import resilience
+import standin_server
+import transport
+from resilience import DeadlineExceeded, RetryPolicy
+from streaming_body import iter_json
+
+REQUEST = {"instances": [{"prompt": "test"}], "parameters": {"sampleCount": 1, "seed": 1}}
+FAST = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.02, deadline=10, hedge=False)
+
+
+def make_config(**overrides):
+    settings = dict(latency=0.01, sigma=0.0, slow_rate=0.0, slow_factor=1.0,
+                    rate_429=0.0, rate_503=0.0, retry_after=0.0)
+    settings.update(overrides)
+    return standin_server.StandInConfig(**settings)
+
+
+@pytest.fixture
+def standin():
+    servers = []
+
+    def start(path=":predict", **overrides):
+        server = standin_server.serve(0, make_config(**overrides))
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1/models/standin{path}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def counting_post(url):
+    calls = []
+
+    def post():
+        calls.append(time.monotonic())
+        return transport.post_stream(url, {"Content-Type": "application/json"}, iter_json(REQUEST))
+
+    return post, calls
+
+
+def stat_delta(before, field):
+    return getattr(resilience.get_stats(), field) - getattr(before, field)
+
+
+def test_success_is_returned_without_retry(standin):
+    post, calls = counting_post(standin())
+    response = resilience.call("test-ok", post, FAST)
+    assert len(response["predictions"]) == 1
+    assert len(calls) == 1
+
+
+def test_503_is_retried_until_attempts_run_out(standin):
+    post, calls = counting_post(standin(rate_503=1.0))
+    before = resilience.get_stats()
+    with pytest.raises(Exception) as info:
+        resilience.call("test-503", post, FAST)
+    assert resilience._status_code(info.value) == 503
+    assert len(calls) == FAST.max_attempts
+    assert stat_delta(before, "retries") == FAST.max_attempts - 1
+    assert stat_delta(before, "failures") == 1
+
+
+def test_non_retryable_status_fails_at_once(standin):
+    post, calls = counting_post(standin(path=":unknown"))
+    with pytest.raises(Exception) as info:
+        resilience.call("test-404", post, FAST)
+    assert resilience._status_code(info.value) == 404
+    assert len(calls) == 1
+
+
+def test_retry_after_beyond_the_deadline_is_not_waited_for(standin):
+    post, calls = counting_post(standin(rate_429=1.0, retry_after=5))
+    started = time.monotonic()
+    with pytest.raises(Exception) as info:
+        resilience.call("test-429", post, RetryPolicy(max_attempts=5, deadline=1.0, hedge=False))
+    assert resilience._status_code(info.value) == 429
+    assert len(calls) == 1
+    assert time.monotonic() - started < 1.0
+
+
+def test_retry_after_is_honored(standin):
+    post, calls = counting_post(standin(rate_429=1.0, retry_after=0.3))
+    with pytest.raises(Exception):
+        resilience.call("test-429-wait", post, RetryPolicy(max_attempts=2, base_delay=0.0, deadline=5, hedge=False))
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.3
+
+
+def test_attempt_runs_on_the_calling_thread_without_hedging(standin):
+    import threading
+    post, _ = counting_post(standin())
+    threads = []
+
+    def recording_post():
+        threads.append(threading.current_thread())
+        return post()
+
+    resilience.call("test-inline", recording_post, FAST)
+    assert threads == [threading.current_thread()]
+
+
+def test_hedge_wins_over_a_slow_primary(standin):
+    fast_url = standin(latency=0.02)
+    slow_url = standin(latency=3.0)
+    policy = RetryPolicy(max_attempts=1, deadline=10, hedge=True, hedge_percentile=0.95, hedge_min_samples=5)
+    fast, _ = counting_post(fast_url)
+    for _ in range(5):
+        resilience.call("test-hedge", fast, policy)
+
+    slow, _ = counting_post(slow_url)
+    urls = iter([slow, fast])
+    before = resilience.get_stats()
+    started = time.monotonic()
+    response = resilience.call("test-hedge", lambda: next(urls)(), policy)
+    assert "predictions" in response
+    assert time.monotonic() - started < 2.0
+    assert stat_delta(before, "hedges") == 1
+    assert stat_delta(before, "hedge_wins") == 1
+
+
+def test_hedge_deadline_raises(standin):
+    slow, _ = counting_post(standin(latency=2.0))
+    policy = RetryPolicy(max_attempts=1, deadline=0.5, hedge=True, hedge_min_samples=1)
+    resilience.get_tracker("test-hedge-deadline").record(0.1)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        resilience.call("test-hedge-deadline", slow, policy)
+    assert time.monotonic() - started < 1.5
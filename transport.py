@@ -0,0 +1,169 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuration variables
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))  # number of hosts to keep pools for
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))  # keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))  # Imagen edits can take minutes
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+
+@dataclass
+class TransportStats:
+    requests: int = 0
+    connections_opened: Optional[int] = 0  # None when the backend cannot report it
+    http_version: str = "HTTP/1.1"
+
+    @property
+    def connections_reused(self) -> Optional[int]:
+        if self.connections_opened is None:
+            return None
+        return max(self.requests - self.connections_opened, 0)
+
+    def summary(self) -> str:
+        if self.connections_opened is None:
+            return f"{self.http_version}: {self.requests} requests"
+        return (f"{self.http_version}: {self.requests} requests, "
+                f"{self.connections_opened} connections opened, "
+                f"{self.connections_reused} reused")
+
+
+class _Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+
+def _make_counting_adapter(counter: _Counter, **kwargs):
+    """HTTPAdapter whose connection pools count every new TCP/TLS connection"""
+    # requests is imported on first use to keep module import cheap
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+        def _new_conn(self):
+            counter.record_connection()
+            return super()._new_conn()
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        def _new_conn(self):
+            counter.record_connection()
+            return super()._new_conn()
+
+    class CountingAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **pool_kwargs):
+            super().init_poolmanager(*args, **pool_kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": CountingHTTPConnectionPool,
+                "https": CountingHTTPSConnectionPool,
+            }
+
+    return CountingAdapter(**kwargs)
+
+
+class Transport:
+    """
+    Shared HTTP client for the Imagen :predict endpoint.
+    Keeps connections alive in a pool so repeated edits skip the TCP+TLS handshake.
+    """
+
+    def __init__(self,
+                 pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+                 read_timeout: float = HTTP_READ_TIMEOUT,
+                 http2: bool = HTTP2_ENABLED):
+        self._counter = _Counter()
+        self._timeout = (connect_timeout, read_timeout)
+        self._client = None
+        self._session = None
+        if http2:
+            try:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=pool_connections * pool_maxsize,
+                        max_keepalive_connections=pool_maxsize
+                    ),
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                )
+            except ImportError:
+                print("Warning: HTTP2_ENABLED is set but httpx[http2] is not installed. Falling back to HTTP/1.1.")
+        if self._client is None:
+            import requests
+            self._session = requests.Session()
+            adapter = _make_counting_adapter(
+                self._counter,
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize
+            )
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+
+    def post(self, url, headers, json=None, data=None, timeout=None):
+        """POST a request and return the parsed JSON response"""
+        self._counter.record_request()
+        if self._client is not None:
+            kwargs = {"timeout": timeout} if timeout is not None else {}
+            response = self._client.post(url, headers=headers, json=json, content=data, **kwargs)
+        else:
+            response = self._session.post(url, headers=headers, json=json, data=data,
+                                          timeout=timeout or self._timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self) -> TransportStats:
+        if self._client is not None:
+            return TransportStats(requests=self._counter.requests, connections_opened=None,
+                                  http_version="HTTP/2")
+        return TransportStats(requests=self._counter.requests,
+                              connections_opened=self._counter.connections)
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+        else:
+            self._session.close()
+
+
+_default_transport: Optional[Transport] = None
+_default_transport_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = Transport()
+    return _default_transport
+
+
+def post_json(url, headers, request_data):
+    return get_transport().post(url, headers, json=request_data)
+
+
+def post_stream(url, headers, body):
+    """POST an iterable of byte chunks (sent with chunked transfer encoding)"""
+    return get_transport().post(url, headers, data=body)
+
+
+def get_stats() -> TransportStats:
+    return get_transport().stats()
@@ -0,0 +1,67 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, List
+
+import streamlit as st
+
+import artifact_store
+import encoded_asset
+from encoded_asset import EncodedAsset
+
+
+@dataclass
+class UploadHandle:
+    file_id: str
+    name: str
+    path: str
+    asset: EncodedAsset
+
+    @property
+    def content_hash(self) -> str:
+        return self.asset.content_hash
+
+    @property
+    def mime_type(self) -> str:
+        return self.asset.mime_type
+
+
+def _file_id(uploaded_file) -> str:
+    # Older Streamlit versions have no file_id; name and size identify the upload well enough there
+    return getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+
+
+def ingest_uploads(uploaded_files, key: str) -> List[UploadHandle]:
+    """
+    Store each upload once per session and return the same handle on later reruns.
+    Files whose upload has been removed from the widget are deleted.
+    key identifies the file_uploader widget.
+    """
+    registry: Dict[str, UploadHandle] = st.session_state.setdefault(f"_ingested_{key}", {})
+    session_id = artifact_store.current_session_id()
+
+    handles = []
+    for uploaded_file in uploaded_files or []:
+        file_id = _file_id(uploaded_file)
+        handle = registry.get(file_id)
+        if handle is None or not os.path.exists(handle.path):
+            data = uploaded_file.getvalue()
+            extension = os.path.splitext(uploaded_file.name)[1] or ".png"
+            path = artifact_store.get_store().put(session_id, data, extension)
+            # Encoded once here; Gemini and Imagen calls reuse it through encoded_asset.get_asset(path)
+            handle = UploadHandle(
+                file_id=file_id,
+                name=uploaded_file.name,
+                path=path,
+                asset=encoded_asset.register(path, data),
+            )
+            registry[file_id] = handle
+        handles.append(handle)
+
+    current_ids = {handle.file_id for handle in handles}
+    for file_id in list(registry):
+        if file_id not in current_ids:
+            removed = registry.pop(file_id)
+            # The same content may still be referenced by another upload in this widget
+            if all(handle.path != removed.path for handle in registry.values()):
+                artifact_store.get_store().remove(removed.path)
+    return handles